@@ -0,0 +1,475 @@
+"""
+A bitboard backend for the GameState. Each piece type of each color is stored as a 64-bit
+integer where bit (row * 8 + col) is set if that piece is on the square. Knight, king and pawn
+attacks are read from precomputed tables and sliding attacks are looked up from tables indexed
+by the occupancy of the rank, file or diagonal the piece is on, all built once at import.
+"""
+
+PIECES = ["wP", "wN", "wB", "wR", "wQ", "wK", "bP", "bN", "bB", "bR", "bQ", "bK"]
+PIECE_INDEX = {piece: i for i, piece in enumerate(PIECES)}
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+WHITE, BLACK = 0, 1
+
+# flags packed into the top bits of a generated move (start | end << 6 | flag << 12)
+NORMAL = 0
+EN_PASSANT = 1
+CASTLE = 2
+
+# castle rights bits
+WHITE_KINGSIDE = 1
+BLACK_KINGSIDE = 2
+WHITE_QUEENSIDE = 4
+BLACK_QUEENSIDE = 8
+
+FULL = (1 << 64) - 1
+
+
+def in_bounds(r, c):
+    return 0 <= r <= 7 and 0 <= c <= 7
+
+
+def step_table(steps):
+    """
+    Builds a table of attacked squares for a piece that moves a single step in each of the
+    given directions (knights and kings). Returns a list of 64 bitboards.
+    """
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        attacks = 0
+        for d in steps:
+            if in_bounds(r + d[0], c + d[1]):
+                attacks |= 1 << ((r + d[0]) * 8 + c + d[1])
+        table.append(attacks)
+    return table
+
+
+def slide(r, c, directions, occupied):
+    """
+    Walks outward from (r, c) in the given directions, stopping at (and including) the first
+    occupied square. Returns the bitboard of attacked squares.
+    """
+    attacks = 0
+    for d in directions:
+        new_r = r + d[0]
+        new_c = c + d[1]
+        while in_bounds(new_r, new_c):
+            attacks |= 1 << (new_r * 8 + new_c)
+            if occupied & (1 << (new_r * 8 + new_c)):
+                break
+            new_r += d[0]
+            new_c += d[1]
+    return attacks
+
+
+def line_tables(directions):
+    """
+    Builds the occupancy masks and attack lookups for one line (a rank, file or diagonal)
+    through every square. The mask leaves out the edge squares since a blocker there never
+    changes the attacks, so each square has at most 64 occupancy keys. Returns (masks, tables).
+    """
+    masks = []
+    tables = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        mask = 0
+        for d in directions:
+            new_r = r + d[0]
+            new_c = c + d[1]
+            while in_bounds(new_r + d[0], new_c + d[1]):
+                mask |= 1 << (new_r * 8 + new_c)
+                new_r += d[0]
+                new_c += d[1]
+        table = {}
+        subset = 0
+        while True: # enumerating every subset of the mask
+            table[subset] = slide(r, c, directions, subset)
+            subset = (subset - mask) & mask
+            if subset == 0:
+                break
+        masks.append(mask)
+        tables.append(table)
+    return masks, tables
+
+
+KNIGHT_ATTACKS = step_table(((2, 1), (2, -1), (-2, 1), (-2, -1), (1, 2), (1, -2), (-1, 2), (-1, -2)))
+KING_ATTACKS = step_table(((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1)))
+# squares attacked by a pawn of the given color standing on each square
+PAWN_ATTACKS = [step_table(((-1, -1), (-1, 1))), step_table(((1, -1), (1, 1)))]
+
+RANK_MASKS, RANK_ATTACKS = line_tables(((0, 1), (0, -1)))
+FILE_MASKS, FILE_ATTACKS = line_tables(((1, 0), (-1, 0)))
+DIAG_MASKS, DIAG_ATTACKS = line_tables(((1, 1), (-1, -1)))
+ANTI_MASKS, ANTI_ATTACKS = line_tables(((1, -1), (-1, 1)))
+
+ROOK_RAYS = [RANK_ATTACKS[sq][0] | FILE_ATTACKS[sq][0] for sq in range(64)]
+BISHOP_RAYS = [DIAG_ATTACKS[sq][0] | ANTI_ATTACKS[sq][0] for sq in range(64)]
+
+
+def between_table():
+    """
+    Builds a 64 x 64 table of the squares strictly between two squares on the same line
+    (0 if they do not share a rank, file or diagonal).
+    """
+    table = [[0] * 64 for _ in range(64)]
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        for d in ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1)):
+            squares = 0
+            new_r = r + d[0]
+            new_c = c + d[1]
+            while in_bounds(new_r, new_c):
+                table[sq][new_r * 8 + new_c] = squares
+                squares |= 1 << (new_r * 8 + new_c)
+                new_r += d[0]
+                new_c += d[1]
+    return table
+
+
+BETWEEN = between_table()
+
+
+def rook_attacks(sq, occupied):
+    return RANK_ATTACKS[sq][occupied & RANK_MASKS[sq]] | FILE_ATTACKS[sq][occupied & FILE_MASKS[sq]]
+
+
+def bishop_attacks(sq, occupied):
+    return DIAG_ATTACKS[sq][occupied & DIAG_MASKS[sq]] | ANTI_ATTACKS[sq][occupied & ANTI_MASKS[sq]]
+
+
+class Bitboards:
+
+    def __init__(self, board):
+        """__init__: builds the bitboards and a mailbox (the piece on each square by row * 8 + col) from an 8x8 board"""
+        self.pieces = [0] * 12
+        self.colors = [0, 0]
+        self.mailbox = ["--"] * 64
+        for r in range(8):
+            for c in range(8):
+                if board[r][c] != "--":
+                    self.set_square(r, c, board[r][c])
+
+
+
+
+    def set_square(self, r, c, piece):
+        """
+        Places a piece (or "--" for an empty square) on (r, c), replacing whatever was there.
+        Does not return anything.
+        """
+        bit = 1 << (r * 8 + c)
+        old = self.mailbox[r * 8 + c]
+        if old != "--":
+            i = PIECE_INDEX[old]
+            self.pieces[i] ^= bit
+            self.colors[i // 6] ^= bit
+        if piece != "--":
+            i = PIECE_INDEX[piece]
+            self.pieces[i] ^= bit
+            self.colors[i // 6] ^= bit
+        self.mailbox[r * 8 + c] = piece
+
+
+
+
+    def is_attacked(self, sq, by, occupied, removed=0):
+        """
+        Checks if a square is attacked by the given color with the given occupancy, not counting
+        pieces on the removed squares (a piece about to be captured). Returns a boolean value.
+        """
+        pieces = self.pieces
+        base = by * 6
+        keep = ~removed
+        return bool((KNIGHT_ATTACKS[sq] & pieces[base + KNIGHT] & keep) or
+                    (PAWN_ATTACKS[1 - by][sq] & pieces[base + PAWN] & keep) or
+                    (KING_ATTACKS[sq] & pieces[base + KING]) or
+                    (rook_attacks(sq, occupied) & (pieces[base + ROOK] | pieces[base + QUEEN]) & keep) or
+                    (bishop_attacks(sq, occupied) & (pieces[base + BISHOP] | pieces[base + QUEEN]) & keep))
+
+
+
+
+    def attack_map(self, by, occupied):
+        """
+        Gets every square attacked by the given color with the given occupancy. Returns a bitboard.
+        """
+        pieces = self.pieces
+        base = by * 6
+        attacked = 0
+        for piece, table in ((PAWN, PAWN_ATTACKS[by]), (KNIGHT, KNIGHT_ATTACKS), (KING, KING_ATTACKS)):
+            bb = pieces[base + piece]
+            while bb:
+                low = bb & -bb
+                bb ^= low
+                attacked |= table[low.bit_length() - 1]
+        for piece, attacks in ((BISHOP, bishop_attacks), (ROOK, rook_attacks)):
+            bb = pieces[base + piece] | pieces[base + QUEEN]
+            while bb:
+                low = bb & -bb
+                bb ^= low
+                attacked |= attacks(low.bit_length() - 1, occupied)
+        return attacked
+
+
+
+
+    def get_valid_moves(self, white_to_move, castle_rights, en_passant):
+        """
+        Generates every legal move for the side to move. Returns (moves, in_check) where each
+        move is packed as start | end << 6 | flag << 12.
+        """
+        stages = self.move_stages(white_to_move, castle_rights, en_passant)
+        moves = next(stages)
+        moves += next(stages)
+        return moves, self.in_check
+
+
+
+
+    def move_stages(self, white_to_move, castle_rights, en_passant):
+        """
+        Generates the legal moves lazily in two stages, yielding a list of captures and
+        promotions and then a list of the quiet moves, so a search that cuts off on a capture
+        never generates the quiet moves. Checks and pins are resolved with masks, so no illegal
+        move is ever generated. Sets in_check before the first list is yielded.
+        """
+        us = WHITE if white_to_move else BLACK
+        them = 1 - us
+        pieces = self.pieces
+        own = self.colors[us]
+        enemy = self.colors[them]
+        occupied = own | enemy
+        empty = ~occupied
+        base = us * 6
+        e_base = them * 6
+        e_rooks = pieces[e_base + ROOK] | pieces[e_base + QUEEN]
+        e_bishops = pieces[e_base + BISHOP] | pieces[e_base + QUEEN]
+        king = pieces[base + KING]
+        k_sq = king.bit_length() - 1
+
+        checkers = (KNIGHT_ATTACKS[k_sq] & pieces[e_base + KNIGHT]) | \
+                   (PAWN_ATTACKS[us][k_sq] & pieces[e_base + PAWN]) | \
+                   (rook_attacks(k_sq, occupied) & e_rooks) | \
+                   (bishop_attacks(k_sq, occupied) & e_bishops)
+        self.in_check = bool(checkers)
+        # king moves, looked up with the king removed so it cannot hide behind itself
+        no_king = occupied ^ king
+        king_targets = KING_ATTACKS[k_sq] & ~own
+        if checkers & (checkers - 1): # double check, only the king can move
+            yield self.king_moves(k_sq, king_targets & enemy, them, no_king)
+            yield self.king_moves(k_sq, king_targets & empty, them, no_king)
+            return
+        if checkers:
+            check_sq = checkers.bit_length() - 1
+            check_mask = checkers | BETWEEN[k_sq][check_sq]
+        else:
+            check_mask = FULL
+
+        # pins, found by looking at every enemy slider on an empty-board ray from the king
+        pinned = 0
+        pin_rays = {}
+        snipers = (ROOK_RAYS[k_sq] & e_rooks) | (BISHOP_RAYS[k_sq] & e_bishops)
+        while snipers:
+            low = snipers & -snipers
+            snipers ^= low
+            sniper = low.bit_length() - 1
+            blockers = BETWEEN[k_sq][sniper] & occupied
+            if blockers and not (blockers & (blockers - 1)) and blockers & own:
+                pinned |= blockers
+                pin_rays[blockers.bit_length() - 1] = BETWEEN[k_sq][sniper] | low
+
+        forward = -8 if us == WHITE else 8
+        start_row = 6 if us == WHITE else 1
+        last_row = 0 if us == WHITE else 7
+        pawns = pieces[base + PAWN]
+
+        # captures and promotions
+        moves = self.king_moves(k_sq, king_targets & enemy, them, no_king)
+        self.piece_moves(moves, base, enemy & check_mask, occupied, pinned, pin_rays)
+        ep_bit = 1 << (en_passant[0] * 8 + en_passant[1]) if en_passant else 0
+        bb = pawns
+        while bb:
+            low = bb & -bb
+            bb ^= low
+            start = low.bit_length() - 1
+            allowed = check_mask & pin_rays[start] if low & pinned else check_mask
+            one = start + forward
+            if one >> 3 == last_row and (empty >> one) & 1 and (allowed >> one) & 1:
+                moves.append(start | one << 6)
+            targets = PAWN_ATTACKS[us][start] & enemy & allowed
+            while targets:
+                t = targets & -targets
+                targets ^= t
+                moves.append(start | (t.bit_length() - 1) << 6)
+            if PAWN_ATTACKS[us][start] & ep_bit and self.en_passant_is_legal(start, ep_bit.bit_length() - 1, us, k_sq):
+                moves.append(start | (ep_bit.bit_length() - 1) << 6 | EN_PASSANT << 12)
+        yield moves
+
+        # quiet moves
+        moves = self.king_moves(k_sq, king_targets & empty, them, no_king)
+        self.piece_moves(moves, base, empty & check_mask, occupied, pinned, pin_rays)
+        bb = pawns
+        while bb:
+            low = bb & -bb
+            bb ^= low
+            start = low.bit_length() - 1
+            one = start + forward
+            if one >> 3 == last_row or not (empty >> one) & 1:
+                continue
+            allowed = check_mask & pin_rays[start] if low & pinned else check_mask
+            if (allowed >> one) & 1:
+                moves.append(start | one << 6)
+            two = one + forward
+            if start >> 3 == start_row and (empty >> two) & 1 and (allowed >> two) & 1:
+                moves.append(start | two << 6)
+        if not checkers:
+            moves += self.castle_moves(us, k_sq, occupied, castle_rights)
+        yield moves
+
+
+
+
+    def king_moves(self, k_sq, targets, them, no_king):
+        """
+        Gets the king moves to the target squares that are not attacked. Returns a list of moves.
+        """
+        moves = []
+        while targets:
+            low = targets & -targets
+            targets ^= low
+            end = low.bit_length() - 1
+            if not self.is_attacked(end, them, no_king):
+                moves.append(k_sq | end << 6)
+        return moves
+
+
+
+
+    def piece_moves(self, moves, base, allowed, occupied, pinned, pin_rays):
+        """
+        Adds the knight, bishop, rook and queen moves to the allowed squares to moves, keeping
+        pinned pieces on their pin rays. Does not return anything.
+        """
+        pieces = self.pieces
+        # knights (a pinned knight can never move)
+        bb = pieces[base + KNIGHT] & ~pinned
+        while bb:
+            low = bb & -bb
+            bb ^= low
+            start = low.bit_length() - 1
+            targets = KNIGHT_ATTACKS[start] & allowed
+            while targets:
+                t = targets & -targets
+                targets ^= t
+                moves.append(start | (t.bit_length() - 1) << 6)
+        # sliders
+        for piece, attacks in ((BISHOP, bishop_attacks), (ROOK, rook_attacks)):
+            bb = pieces[base + piece] | pieces[base + QUEEN]
+            while bb:
+                low = bb & -bb
+                bb ^= low
+                start = low.bit_length() - 1
+                targets = attacks(start, occupied) & allowed
+                if low & pinned:
+                    targets &= pin_rays[start]
+                while targets:
+                    t = targets & -targets
+                    targets ^= t
+                    moves.append(start | (t.bit_length() - 1) << 6)
+
+
+
+
+    def en_passant_is_legal(self, start, end, us, k_sq):
+        """
+        Checks if the en passant capture from start to end leaves the king safe. The two pawns
+        leave the rank at once, so the king is checked directly afterwards. Returns a boolean value.
+        """
+        pieces = self.pieces
+        e_base = (1 - us) * 6
+        captured = end + (8 if us == WHITE else -8)
+        after = (self.colors[WHITE] | self.colors[BLACK]) ^ (1 << start) ^ (1 << end) ^ (1 << captured)
+        return not ((rook_attacks(k_sq, after) & (pieces[e_base + ROOK] | pieces[e_base + QUEEN])) or
+                    (bishop_attacks(k_sq, after) & (pieces[e_base + BISHOP] | pieces[e_base + QUEEN])) or
+                    (KNIGHT_ATTACKS[k_sq] & pieces[e_base + KNIGHT]) or
+                    (PAWN_ATTACKS[us][k_sq] & pieces[e_base + PAWN] & ~(1 << captured)))
+
+
+
+
+    def castle_moves(self, us, k_sq, occupied, castle_rights):
+        """
+        Gets the castling moves with the king not in check. Returns a list of moves.
+        """
+        moves = []
+        them = 1 - us
+        if us == WHITE:
+            kingside, queenside = castle_rights & WHITE_KINGSIDE, castle_rights & WHITE_QUEENSIDE
+        else:
+            kingside, queenside = castle_rights & BLACK_KINGSIDE, castle_rights & BLACK_QUEENSIDE
+        if kingside and not occupied & (0b11 << (k_sq + 1)) and \
+                not self.is_attacked(k_sq + 1, them, occupied) and not self.is_attacked(k_sq + 2, them, occupied):
+            moves.append(k_sq | (k_sq + 2) << 6 | CASTLE << 12)
+        if queenside and not occupied & (0b111 << (k_sq - 3)) and \
+                not self.is_attacked(k_sq - 1, them, occupied) and not self.is_attacked(k_sq - 2, them, occupied):
+            moves.append(k_sq | (k_sq - 2) << 6 | CASTLE << 12)
+        return moves
+
+
+
+
+    def is_legal(self, start, end, flag, white_to_move, castle_rights, en_passant):
+        """
+        Checks if a move is legal without generating the moves, for trying a move remembered
+        from another position (a hash or killer move) before the move generator runs. The move
+        is packed the same way as a generated one. Returns a boolean value.
+        """
+        us = WHITE if white_to_move else BLACK
+        them = 1 - us
+        mailbox = self.mailbox
+        if mailbox[start] == "--" or PIECE_INDEX[mailbox[start]] // 6 != us:
+            return False
+        piece = PIECE_INDEX[mailbox[start]] % 6
+        own = self.colors[us]
+        occupied = own | self.colors[them]
+        king = self.pieces[us * 6 + KING]
+        k_sq = king.bit_length() - 1
+        start_bit = 1 << start
+        end_bit = 1 << end
+        if end_bit & own:
+            return False
+        if flag == CASTLE:
+            return piece == KING and not self.is_attacked(k_sq, them, occupied) and \
+                   start | end << 6 | CASTLE << 12 in self.castle_moves(us, k_sq, occupied, castle_rights)
+        if flag == EN_PASSANT:
+            return piece == PAWN and bool(en_passant) and end == en_passant[0] * 8 + en_passant[1] and \
+                   bool(PAWN_ATTACKS[us][start] & end_bit) and self.en_passant_is_legal(start, end, us, k_sq)
+        # the piece has to be able to reach the end square
+        if piece == PAWN:
+            forward = -8 if us == WHITE else 8
+            if end_bit & self.colors[them]:
+                if not PAWN_ATTACKS[us][start] & end_bit:
+                    return False
+            elif end == start + forward:
+                if end_bit & occupied:
+                    return False
+            elif end == start + 2 * forward and start >> 3 == (6 if us == WHITE else 1):
+                if ((1 << (start + forward)) | end_bit) & occupied:
+                    return False
+            else:
+                return False
+        elif piece == KNIGHT:
+            reach = KNIGHT_ATTACKS[start]
+        elif piece == BISHOP:
+            reach = bishop_attacks(start, occupied)
+        elif piece == ROOK:
+            reach = rook_attacks(start, occupied)
+        elif piece == QUEEN:
+            reach = rook_attacks(start, occupied) | bishop_attacks(start, occupied)
+        else:
+            reach = KING_ATTACKS[start]
+        if piece != PAWN and not reach & end_bit:
+            return False
+        # and the king cannot be attacked afterwards
+        k_sq = end if piece == KING else k_sq
+        return not self.is_attacked(k_sq, them, (occupied ^ start_bit) | end_bit, end_bit)
@@ -1,12 +1,79 @@
-import numpy as np
+import random
+from array import array
+import bitboard
+
+# random keys for Zobrist hashing, seeded so that every process hashes positions the same way
+zobrist_random = random.Random(20240611)
+ZOBRIST_PIECES = {piece: [zobrist_random.getrandbits(64) for sq in range(64)] for piece in bitboard.PIECES}
+ZOBRIST_PIECES["--"] = [0] * 64
+ZOBRIST_CASTLE = [zobrist_random.getrandbits(64) for rights in range(16)]
+ZOBRIST_EN_PASSANT = [zobrist_random.getrandbits(64) for col in range(8)]
+ZOBRIST_BLACK_TO_MOVE = zobrist_random.getrandbits(64)
+
+# 4-bit piece codes for packing moves into integers, 12 is an empty square
+PIECE_NAMES = bitboard.PIECES + ["--"]
+PIECE_CODES = {piece: i for i, piece in enumerate(PIECE_NAMES)}
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+# castle rights are kept as 4 bits (see bitboard.WHITE_KINGSIDE). A move from or to a square
+# clears the rights of the king or rook that starts there
+WKS, BKS, WQS, BQS = bitboard.WHITE_KINGSIDE, bitboard.BLACK_KINGSIDE, bitboard.WHITE_QUEENSIDE, bitboard.BLACK_QUEENSIDE
+CASTLE_MASKS = [15] * 64
+CASTLE_MASKS[7 * 8 + 4] = 15 & ~(WKS | WQS)
+CASTLE_MASKS[7 * 8 + 7] = 15 & ~WKS
+CASTLE_MASKS[7 * 8 + 0] = 15 & ~WQS
+CASTLE_MASKS[0 * 8 + 4] = 15 & ~(BKS | BQS)
+CASTLE_MASKS[0 * 8 + 7] = 15 & ~BKS
+CASTLE_MASKS[0 * 8 + 0] = 15 & ~BQS
+
+# the state make_move cannot work out again from the move, packed into one word per move on the
+# state stack: castle rights | (en passant square + 1, 0 for none) << 4 | halfmove clock << 11
+EN_PASSANT_SQUARES = [()] + [divmod(sq, 8) for sq in range(64)]
+STATE_STACK_PLIES = 256 # the stack doubles when a game runs longer
+FIFTY_MOVE_PLIES = 100 # plies without a capture or pawn move before the game is drawn
+
+# (row, col) steps of the pieces
+ROOK_DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1))
+BISHOP_DIRECTIONS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+KNIGHT_STEPS = ((2, 1), (2, -1), (-2, 1), (-2, -1), (1, 2), (1, -2), (-1, 2), (-1, -2))
+KING_STEPS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+
+def encode_move(start, end, piece_moved, piece_captured, is_en_passant=False, is_castle_move=False):
+    """
+    Packs a move into an integer: start square | end square << 6 | moved piece << 12 | captured
+    piece << 16 | flag << 20, where squares are row * 8 + col and the flag is 1 for en passant
+    and 2 for castling. Returns the code.
+    """
+    flag = bitboard.EN_PASSANT if is_en_passant else bitboard.CASTLE if is_castle_move else bitboard.NORMAL
+    return start | end << 6 | PIECE_CODES[piece_moved] << 12 | PIECE_CODES[piece_captured] << 16 | flag << 20
+
+
+def get_move(start, end, board, is_en_passant=False, is_castle_move=False):
+    """
+    Same as Move(start, end, board, is_en_passant, is_castle_move), but gives the pooled Move
+    instead of building a new one. Returns the Move.
+    """
+    piece_moved = board[start[0]][start[1]]
+    if is_en_passant:
+        piece_captured = "bP" if piece_moved == "wP" else "wP"
+    else:
+        piece_captured = board[end[0]][end[1]]
+    code = encode_move(start[0] * 8 + start[1], end[0] * 8 + end[1], piece_moved, piece_captured, 
+                       is_en_passant, is_castle_move)
+    return Move.from_code(code)
+
 
 class GameState:
 
-    def __init__(self):
-        """__init__: defines a new chess game. checkmate and check are set to false"""
+    def __init__(self, use_bitboards=False, fen=None):
+        """
+        __init__: defines a new chess game. checkmate and check are set to false. If use_bitboards
+        is set, moves are generated from bitboards (see bitboard.py) instead of the board array.
+        If a FEN string is given, the game starts from that position instead.
+        """
 
-        self.board = np.array( # defining the board
-        [
+        self.board = [ # defining the board, a list of rows of piece strings
             ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
             ["bP", "bP", "bP", "bP", "bP", "bP", "bP", "bP"],
             ["--", "--", "--", "--", "--", "--", "--", "--"],
@@ -15,7 +82,7 @@ class GameState:
             ["--", "--", "--", "--", "--", "--", "--", "--"],
             ["wP", "wP", "wP", "wP", "wP", "wP", "wP", "wP"],
             ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"]
-        ])
+        ]
         # variables/flags needed throughout the game
         self.white_to_move = True
         self.move_log = []
@@ -26,13 +93,86 @@ class GameState:
         self.bK_pos = (0, 4)
         self.pins = []
         self.checks = []
+        self.pin_directions = {} # (row, col) of each pinned piece to the direction of its pin
+        self.check_mask = bitboard.FULL # squares a move has to end on to stop the check
         self.possible_en_passant = ()
-        self.current_castle_rights = CastleRights(True, True, True, True)
-        self.current_castle_rights_log = [CastleRights(self.current_castle_rights.wks, 
-                                                       self.current_castle_rights.bks, 
-                                                       self.current_castle_rights.wqs, 
-                                                       self.current_castle_rights.bqs)]
-        
+        self.castle_rights = WKS | BKS | WQS | BQS
+        self.halfmove_clock = 0 # moves since the last capture or pawn move
+        # the Zobrist key and packed state before each move in move_log, two words per move
+        self.state_stack = array("Q", bytes(16 * STATE_STACK_PLIES))
+        self.bitboards = bitboard.Bitboards(self.board) if use_bitboards else None
+        # the pieces of each color by square, kept up to date by set_square
+        self.piece_squares = self.index_pieces()
+        # 64-bit key identifying the position, kept up to date by make_move and undo_move
+        self.zobrist_key = self.compute_zobrist_key()
+        # running evaluation total, kept up to date once a table is given to track_score
+        self.square_scores = None
+        self.board_score = 0
+        if fen is not None:
+            self.load_fen(fen)
+
+
+
+
+    def load_fen(self, fen):
+        """
+        Sets up the position given in Forsyth-Edwards Notation and clears the move log. The move
+        counters at the end of the FEN are optional. Does not return anything.
+        """
+        fields = fen.split()
+        board = []
+        for rank in fields[0].split("/"):
+            row = []
+            for char in rank:
+                if char.isdigit():
+                    row.extend(["--"] * int(char))
+                else:
+                    row.append(("w" if char.isupper() else "b") + char.upper())
+            board.append(row)
+        self.board = board
+        for r in range(len(self.board)):
+            for c in range(len(self.board[r])):
+                if self.board[r][c] == "wK":
+                    self.wK_pos = (r, c)
+                elif self.board[r][c] == "bK":
+                    self.bK_pos = (r, c)
+        self.white_to_move = fields[1] == "w"
+        castle = fields[2] if len(fields) > 2 else "-"
+        self.castle_rights = ("K" in castle) * WKS | ("k" in castle) * BKS | ("Q" in castle) * WQS | ("q" in castle) * BQS
+        en_passant = fields[3] if len(fields) > 3 else "-"
+        if en_passant == "-":
+            self.possible_en_passant = ()
+        else:
+            self.possible_en_passant = (Move.ranks_to_rows[en_passant[1]], Move.files_to_cols[en_passant[0]])
+        self.halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+        self.move_log = []
+        self.checkmate = False
+        self.stalemate = False
+        self.in_check = False
+        if self.bitboards is not None:
+            self.bitboards = bitboard.Bitboards(self.board)
+        self.piece_squares = self.index_pieces()
+        self.zobrist_key = self.compute_zobrist_key()
+        if self.square_scores is not None:
+            self.track_score(self.square_scores)
+
+
+
+
+    def _push_state(self):
+        """
+        Pushes the Zobrist key and the packed castle rights, en passant square and halfmove clock 
+        onto the state stack before a move, growing the stack when it is full. Does not return 
+        anything.
+        """
+        i = 2 * len(self.move_log)
+        if i == len(self.state_stack):
+            self.state_stack.extend(array("Q", bytes(8 * i)))
+        en_passant = self.possible_en_passant
+        self.state_stack[i] = self.zobrist_key
+        self.state_stack[i + 1] = self.castle_rights | (en_passant[0] * 8 + en_passant[1] + 1 if en_passant else 0) << 4 | \
+                                  self.halfmove_clock << 11
+
 
 
 
@@ -40,14 +180,21 @@ class GameState:
         """
         Function to make a move on the board. Does not return anything.
         """
-        self.board[move.start_row][move.start_col] = "--"
-        self.board[move.end_row][move.end_col] = move.piece_moved
+        self._push_state()
+        old_en_passant = self.possible_en_passant
+        if move.piece_moved[1] == 'P' or move.piece_captured != "--":
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        self.set_square(move.start_row, move.start_col, "--")
         # pawn promotion (automatically a queen right now)
         if move.pawn_promotion:
             if self.white_to_move:
-                self.board[move.end_row][move.end_col] = "wQ"
+                self.set_square(move.end_row, move.end_col, "wQ")
             else:
-                self.board[move.end_row][move.end_col] = "bQ"
+                self.set_square(move.end_row, move.end_col, "bQ")
+        else:
+            self.set_square(move.end_row, move.end_col, move.piece_moved)
         self.white_to_move = not self.white_to_move
         if move.piece_moved == "wK":
             self.wK_pos = (move.end_row, move.end_col)
@@ -55,8 +202,7 @@ class GameState:
             self.bK_pos = (move.end_row, move.end_col)
         # en passant
         if move.en_passant:
-            move.piece_captured = self.board[move.start_row][move.end_col]
-            self.board[move.start_row][move.end_col] = "--"
+            self.set_square(move.start_row, move.end_col, "--")
         if move.piece_moved[1] == 'P' and abs(move.start_row - move.end_row) == 2:
             self.possible_en_passant = ((move.start_row + move.end_row) // 2, move.end_col)
         else:
@@ -64,16 +210,19 @@ class GameState:
         # castle
         if move.castle:
             if move.end_col - move.start_col == 2: # kingside castle
-                self.board[move.end_row][move.end_col - 1] = self.board[move.end_row][move.end_col + 1]
-                self.board[move.end_row][move.end_col + 1] = "--"
+                self.set_square(move.end_row, move.end_col - 1, self.board[move.end_row][move.end_col + 1])
+                self.set_square(move.end_row, move.end_col + 1, "--")
             elif move.end_col - move.start_col == -2: # queenside castle
-                self.board[move.end_row][move.end_col + 1] = self.board[move.end_row][move.end_col - 2]
-                self.board[move.end_row][move.end_col - 2] = "--"
+                self.set_square(move.end_row, move.end_col + 1, self.board[move.end_row][move.end_col - 2])
+                self.set_square(move.end_row, move.end_col - 2, "--")
+        old_rights = self.castle_rights
         self.update_castle_rights(move)
-        self.current_castle_rights_log.append(CastleRights(self.current_castle_rights.wks, 
-                                                           self.current_castle_rights.bks, 
-                                                           self.current_castle_rights.wqs, 
-                                                           self.current_castle_rights.bqs))
+        # the pieces were hashed in set_square, the rest of the state is hashed here
+        self.zobrist_key ^= ZOBRIST_BLACK_TO_MOVE ^ ZOBRIST_CASTLE[old_rights] ^ ZOBRIST_CASTLE[self.castle_rights]
+        if old_en_passant:
+            self.zobrist_key ^= ZOBRIST_EN_PASSANT[old_en_passant[1]]
+        if self.possible_en_passant:
+            self.zobrist_key ^= ZOBRIST_EN_PASSANT[self.possible_en_passant[1]]
         self.move_log.append(move)
 
 
@@ -84,57 +233,206 @@ class GameState:
         Fucntion to undo a move made on the board. Does not return anything.
         """
         last_move = self.move_log.pop()
-        self.board[last_move.start_row][last_move.start_col] = last_move.piece_moved
-        self.board[last_move.end_row][last_move.end_col] = last_move.piece_captured
+        self.set_square(last_move.start_row, last_move.start_col, last_move.piece_moved)
+        self.set_square(last_move.end_row, last_move.end_col, last_move.piece_captured)
         self.white_to_move = not self.white_to_move
         if last_move.piece_moved == "wK":
             self.wK_pos = (last_move.start_row, last_move.start_col)
         elif last_move.piece_moved == "bK":
             self.bK_pos = (last_move.start_row, last_move.start_col)
         if last_move.en_passant:
-            self.board[last_move.end_row][last_move.end_col] = "--"
-            self.board[last_move.start_row][last_move.end_col] = last_move.piece_captured
-            self.possible_en_passant = (last_move.start_row, last_move.end_col)
-        if last_move.piece_moved[1] == 'P' and abs(last_move.start_row - last_move.end_row) == 2:
-            self.possible_en_passant = ()
+            self.set_square(last_move.end_row, last_move.end_col, "--")
+            self.set_square(last_move.start_row, last_move.end_col, last_move.piece_captured)
         if last_move.castle: 
             if last_move.end_col - last_move.start_col == 2: # kingside
-                self.board[last_move.end_row][last_move.end_col + 1] = self.board[last_move.end_row][last_move.end_col - 1]
-                self.board[last_move.end_row][last_move.end_col - 1] = "--"
+                self.set_square(last_move.end_row, last_move.end_col + 1, self.board[last_move.end_row][last_move.end_col - 1])
+                self.set_square(last_move.end_row, last_move.end_col - 1, "--")
             elif last_move.end_col - last_move.start_col == -2: # queenside
-                self.board[last_move.end_row][last_move.end_col - 2] = self.board[last_move.end_row][last_move.end_col + 1]
-                self.board[last_move.end_row][last_move.end_col + 1] = "--"
+                self.set_square(last_move.end_row, last_move.end_col - 2, self.board[last_move.end_row][last_move.end_col + 1])
+                self.set_square(last_move.end_row, last_move.end_col + 1, "--")
         self.checkmate = False
         self.stalemate = False
-        self.current_castle_rights_log.pop()
-        self.current_castle_rights = self.current_castle_rights_log[-1]
+        i = 2 * len(self.move_log)
+        state = self.state_stack[i + 1]
+        self.castle_rights = state & 15
+        self.possible_en_passant = EN_PASSANT_SQUARES[(state >> 4) & 127]
+        self.halfmove_clock = state >> 11
+        self.zobrist_key = self.state_stack[i]
         
 
 
 
+    def make_null_move(self):
+        """
+        Passes the turn without moving a piece, for null-move pruning in the search. None is 
+        logged in move_log in its place, and it has to be taken back with undo_null_move. Does not 
+        return anything.
+        """
+        self._push_state()
+        old_en_passant = self.possible_en_passant
+        self.halfmove_clock += 1
+        self.white_to_move = not self.white_to_move
+        self.zobrist_key ^= ZOBRIST_BLACK_TO_MOVE
+        if old_en_passant: # the chance to capture en passant is lost
+            self.zobrist_key ^= ZOBRIST_EN_PASSANT[old_en_passant[1]]
+            self.possible_en_passant = ()
+        self.move_log.append(None)
+
+
+
+
+    def undo_null_move(self):
+        """
+        Takes back a move made by make_null_move. Does not return anything.
+        """
+        self.move_log.pop()
+        self.white_to_move = not self.white_to_move
+        self.checkmate = False
+        self.stalemate = False
+        i = 2 * len(self.move_log)
+        state = self.state_stack[i + 1]
+        self.possible_en_passant = EN_PASSANT_SQUARES[(state >> 4) & 127]
+        self.halfmove_clock = state >> 11
+        self.zobrist_key = self.state_stack[i]
+
+
+
+
+    def is_in_check(self):
+        """
+        Checks if the side to move is in check, without generating its moves. Returns a boolean 
+        value.
+        """
+        if self.white_to_move:
+            return self.is_square_attacked(self.wK_pos[0], self.wK_pos[1], 'b')
+        return self.is_square_attacked(self.bK_pos[0], self.bK_pos[1], 'w')
+
+
+
+
+    def is_repetition(self, times=1):
+        """
+        Checks if the position has come up at least times times before with the same side to move. 
+        Only the keys on the state stack since the last capture or pawn move (and the last null 
+        move, which is not a real move) are compared, every second one, as no earlier position 
+        can come up again. Returns a boolean value.
+        """
+        log = self.move_log
+        stack = self.state_stack
+        key = self.zobrist_key
+        found = 0
+        for i in range(len(log) - 2, max(len(log) - self.halfmove_clock, 0) - 1, -2):
+            if log[i] is None or log[i + 1] is None:
+                break
+            if stack[2 * i] == key:
+                found += 1
+                if found == times:
+                    return True
+        return False
+
+
+
+
+    def is_fifty_move_draw(self):
+        """
+        Checks if the game is drawn by the fifty-move rule: fifty moves each without a capture or a 
+        pawn move, unless the last one gave checkmate. Returns a boolean value.
+        """
+        if self.halfmove_clock < FIFTY_MOVE_PLIES:
+            return False
+        return not (self.is_in_check() and len(self.get_valid_moves()) == 0)
+
+
+
+
+    def set_square(self, r, c, piece):
+        """
+        Places a piece (or "--" for an empty square) on (r, c) and keeps the Zobrist key, the 
+        bitboards and the tracked board score (when they are used) in sync. Does not return anything.
+        """
+        if self.bitboards is not None:
+            self.bitboards.set_square(r, c, piece)
+        sq = r * 8 + c
+        old = self.board[r][c]
+        self.zobrist_key ^= ZOBRIST_PIECES[old][sq] ^ ZOBRIST_PIECES[piece][sq]
+        if self.square_scores is not None:
+            self.board_score += self.square_scores[piece][sq] - self.square_scores[old][sq]
+        if old != "--":
+            del self.piece_squares[old[0]][(r, c)]
+        if piece != "--":
+            self.piece_squares[piece[0]][(r, c)] = piece
+        self.board[r][c] = piece
+
+
+
+
+    def index_pieces(self):
+        """
+        Finds every piece on the board. Returns {"w": {(row, col): piece}, "b": {...}}, the form 
+        kept in piece_squares so that loops over the pieces skip the empty squares.
+        """
+        piece_squares = {"w": {}, "b": {}}
+        for r in range(len(self.board)):
+            for c in range(len(self.board[r])):
+                piece = self.board[r][c]
+                if piece != "--":
+                    piece_squares[piece[0]][(r, c)] = piece
+        return piece_squares
+
+
+
+
+    def track_score(self, square_scores):
+        """
+        Keeps board_score equal to the sum of square_scores[piece][row * 8 + col] over every square
+        (square_scores["--"] must be all zeros). It is computed once here and then updated by each
+        square change in make_move and undo_move. Does not return anything.
+        """
+        self.square_scores = square_scores
+        self.board_score = 0
+        for pieces in self.piece_squares.values():
+            for (r, c), piece in pieces.items():
+                self.board_score += square_scores[piece][r * 8 + c]
+
+
+
+
+    def compute_zobrist_key(self):
+        """
+        Computes the Zobrist key of the position from scratch: every piece on its square, the side
+        to move, the castle rights and the en passant file (whenever an en passant square is set).
+        Returns the key.
+        """
+        key = 0
+        for r in range(len(self.board)):
+            for c in range(len(self.board[r])):
+                key ^= ZOBRIST_PIECES[self.board[r][c]][r * 8 + c]
+        if not self.white_to_move:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        key ^= ZOBRIST_CASTLE[self.castle_rights]
+        if self.possible_en_passant:
+            key ^= ZOBRIST_EN_PASSANT[self.possible_en_passant[1]]
+        return key
+
+
+
+
     def update_castle_rights(self, move):
         """
         Updates the castle rights of the given gamestate after a move. Does not return anything.
         """
-        if move.piece_moved == "wK":
-            self.current_castle_rights.wks = False
-            self.current_castle_rights.wqs = False
-        elif move.piece_moved == "bK":
-            self.current_castle_rights.bks = False
-            self.current_castle_rights.bqs = False
-        elif move.piece_moved == "wR":
-            if move.start_row == 7:
-                if move.start_col == 7:
-                    self.current_castle_rights.wks = False
-                elif move.start_col == 0: 
-                    self.current_castle_rights.wqs = False
-        elif move.piece_moved == "bR":
-            if move.start_row == 0:
-                if move.start_col == 7:
-                    self.current_castle_rights.bks = False
-                elif move.start_col == 0: 
-                    self.current_castle_rights.bqs = False
-        self.current_castle_rights_log.append(self.current_castle_rights)
+        self.castle_rights &= CASTLE_MASKS[move.start_row * 8 + move.start_col] & CASTLE_MASKS[move.end_row * 8 + move.end_col]
+
+
+
+
+    @property
+    def current_castle_rights(self):
+        """
+        The castle rights as a CastleRights, for reading only.
+        """
+        rights = self.castle_rights
+        return CastleRights(bool(rights & WKS), bool(rights & BKS), bool(rights & WQS), bool(rights & BQS))
 
 
 
@@ -144,37 +442,31 @@ class GameState:
         Gets all valid moves on the board with the current state. Considers checks, checkmate, and 
         stalemate. Returns a list of valid moves.
         """
+        if self.bitboards is not None:
+            return self.get_bitboard_moves()
         moves = []
         temp_en_passant = self.possible_en_passant
         self.in_check, self.pins, self.checks = self.find_pins_checks()
+        # the pins and the squares that stop a check are worked out once, so the piece 
+        # generators only ever make legal moves
+        self.pin_directions = {(pin[0], pin[1]): (pin[2], pin[3]) for pin in self.pins}
+        self.check_mask = bitboard.FULL
         # setting up the current king position
         if self.white_to_move:
             king_pos = self.wK_pos
         else:
             king_pos = self.bK_pos
-        if self.in_check: # if in check, the number of moves becomes more limited
-            if len(self.checks) == 1: # not a double check (can possibly be blocked)
-                moves = self.get_all_moves() # list of moves to edit
-                check = self.checks[0] 
-                check_row = check[0]
-                check_col = check[1]
-                piece_checking = self.board[check_row][check_col] # finding the piece that is attacking
-                valid_squares = []
-                if piece_checking[1] == 'N': # if knight is attacking, it cannot be blocked, must be taken/king must move
-                    valid_squares = [(check_row, check_col)]
-                else: 
-                    for i in range(1, 8): # all squares in direction of check
-                        valid_square = (king_pos[0] + check[2] * i, king_pos[1] + check[3] * i) # check[2] and check[3] are the direction coordinates
-                        valid_squares.append(valid_square)
-                        if (valid_square[0] == check_row and valid_square[1] == check_col): # stop at the piece that is giving check
-                            break
-                for i in range(len(moves)-1, -1 , -1): # removing elements from move if they are not valid
-                    if moves[i].piece_moved[1] != 'K': # making sure the king can move out of the way
-                        if not ((moves[i].end_row, moves[i].end_col) in valid_squares):
-                            moves.remove(moves[i])
-            else: # double check, must move the king
-                moves = self.get_king_moves(king_pos[0], king_pos[1], moves)
-        else: # no checks, get_all_moves will be OK
+        if len(self.checks) > 1: # double check, must move the king
+            moves = self.get_king_moves(king_pos[0], king_pos[1], moves)
+        else:
+            if self.in_check: # the check has to be blocked or the checking piece taken
+                check_row, check_col, d_row, d_col = self.checks[0]
+                self.check_mask = 0
+                r, c = king_pos
+                while (r, c) != (check_row, check_col): # a knight check is a single step
+                    r += d_row
+                    c += d_col
+                    self.check_mask |= 1 << (r * 8 + c)
             moves = self.get_all_moves()
         if len(moves) == 0: # game has ended
             if self.in_check:
@@ -190,29 +482,109 @@ class GameState:
 
 
 
+    def get_bitboard_moves(self):
+        """
+        Gets all valid moves from the bitboards. Sets the same check, checkmate and stalemate
+        flags as get_valid_moves. Returns a list of valid moves.
+        """
+        codes, self.in_check = self.bitboards.get_valid_moves(self.white_to_move, self.castle_rights, 
+                                                              self.possible_en_passant)
+        moves = self.codes_to_moves(codes)
+        self.checkmate = len(moves) == 0 and self.in_check
+        self.stalemate = len(moves) == 0 and not self.in_check
+        return moves
+
+
+
+
+    def codes_to_moves(self, codes):
+        """
+        Turns moves generated by the bitboards (start | end << 6 | flag << 12) into Moves.
+        Returns a list of Moves.
+        """
+        mailbox = self.bitboards.mailbox
+        pool = Move.pool
+        moves = []
+        for code in codes:
+            # adding the pieces to the generated start | end << 6 | flag << 12 to get the Move code
+            captured = mailbox[(code >> 6) & 63]
+            if code >> 12 == bitboard.EN_PASSANT:
+                captured = "bP" if self.white_to_move else "wP"
+            code = (code & 0xFFF) | PIECE_CODES[mailbox[code & 63]] << 12 | PIECE_CODES[captured] << 16 | (code >> 12) << 20
+            move = pool.get(code)
+            moves.append(move if move is not None else Move.from_code(code))
+        return moves
+
+
+
+
+    def get_move_stages(self):
+        """
+        Generates the valid moves lazily in two stages: yields a list of the captures and 
+        promotions, then a list of the quiet moves, which with bitboards are only generated if 
+        they are asked for. in_check is set once the first list is yielded, and the checkmate and 
+        stalemate flags as soon as a move turns up or both lists are found to be empty.
+        """
+        if self.bitboards is None: # the board array generates every move at once
+            moves = self.get_valid_moves()
+            yield [move for move in moves if move.piece_captured != "--" or move.pawn_promotion]
+            yield [move for move in moves if move.piece_captured == "--" and not move.pawn_promotion]
+            return
+        found = False
+        for codes in self.bitboards.move_stages(self.white_to_move, self.castle_rights, self.possible_en_passant):
+            self.in_check = self.bitboards.in_check
+            if codes and not found:
+                found = True
+                self.checkmate = False
+                self.stalemate = False
+            yield self.codes_to_moves(codes)
+        if not found:
+            self.checkmate = self.in_check
+            self.stalemate = not self.in_check
+
+
+
+
+    def is_valid_move(self, move):
+        """
+        Checks if a move, such as one remembered from another position, is valid in the current 
+        position. With bitboards only that move is looked at, otherwise every move is generated.
+        Returns a boolean value.
+        """
+        if self.bitboards is None:
+            return any(valid.code == move.code for valid in self.get_valid_moves())
+        start = move.start_row * 8 + move.start_col
+        end = move.end_row * 8 + move.end_col
+        mailbox = self.bitboards.mailbox
+        if mailbox[start] != move.piece_moved or (not move.en_passant and mailbox[end] != move.piece_captured):
+            return False
+        return self.bitboards.is_legal(start, end, move.code >> 20, self.white_to_move, self.castle_rights, 
+                                       self.possible_en_passant)
+
+
+
+
     def get_all_moves(self):
         """
-        Function to get all moves on the board. Does not consider checks, but does 
-        consider pins. Returns a list of all moves.
+        Function to get all moves on the board, going through the pieces of the side to move in 
+        piece_squares. Considers checks and pins through the masks set up by get_valid_moves. 
+        Returns a list of all moves.
         """
         moves = []
-        for r in range(len(self.board)):
-            for c in range(len(self.board[0])):
-                turn = self.board[r][c][0]
-                if (turn == 'w' and self.white_to_move) or (turn == 'b' and not self.white_to_move):
-                    piece = self.board[r][c][1]
-                    if piece == 'P':
-                        self.get_pawn_moves(r, c, moves)
-                    if piece == 'R':
-                        self.get_rook_moves(r, c, moves)
-                    if piece == 'N':
-                        self.get_knight_moves(r, c, moves)
-                    if piece == 'B':
-                        self.get_bishop_moves(r, c, moves)
-                    if piece == 'Q':
-                        self.get_queen_moves(r, c, moves)
-                    if piece == 'K':
-                        self.get_king_moves(r, c, moves)
+        for (r, c), piece in self.piece_squares['w' if self.white_to_move else 'b'].items():
+            piece = piece[1]
+            if piece == 'P':
+                self.get_pawn_moves(r, c, moves)
+            if piece == 'R':
+                self.get_rook_moves(r, c, moves)
+            if piece == 'N':
+                self.get_knight_moves(r, c, moves)
+            if piece == 'B':
+                self.get_bishop_moves(r, c, moves)
+            if piece == 'Q':
+                self.get_queen_moves(r, c, moves)
+            if piece == 'K':
+                self.get_king_moves(r, c, moves)
         return moves
 
 
@@ -238,90 +610,75 @@ class GameState:
         A function to add pawn moves to a given list [moves]. Returns the moves list with the new pawn
         moves added.
         """
-        piece_pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins)-1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piece_pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
+        pin_direction = self.pin_directions.get((r, c))
+        piece_pinned = pin_direction is not None
+        check_mask = self.check_mask
         if self.white_to_move:
-            king_row, king_col = self.wK_pos
             if self.board[r-1][c] == "--":
-                if not piece_pinned or pin_direction == (-1, 0):
-                    moves.append(Move((r, c), (r - 1, c), self.board))
-                    if r == 6 and self.board[r-2][c] == "--":
-                        moves.append(Move((r, c), (r - 2, c), self.board))
-            if self.in_bounds(r-1, c+1):
-                if self.board[r-1][c+1][0] == 'b':
-                    if not piece_pinned or pin_direction == (-1, 1):
-                        moves.append(Move((r, c), (r - 1, c + 1), self.board))
-                elif (r - 1, c + 1) == self.possible_en_passant:
-                    moves.append(Move((r, c), (r - 1, c + 1), self.board, is_en_passant=True))
-            if self.in_bounds(r-1, c-1):
-                if self.board[r-1][c-1][0] == 'b':
-                    if not piece_pinned or pin_direction == (-1, -1):
-                        moves.append(Move((r, c), (r - 1, c - 1), self.board))
-                elif (r - 1, c - 1) == self.possible_en_passant:
-                        moves.append(Move((r, c), (r - 1, c - 1), self.board, is_en_passant=True))
+                if not piece_pinned or pin_direction in ((-1, 0), (1, 0)):
+                    if (check_mask >> ((r - 1) * 8 + c)) & 1:
+                        moves.append(get_move((r, c), (r - 1, c), self.board))
+                    if r == 6 and self.board[r-2][c] == "--" and (check_mask >> ((r - 2) * 8 + c)) & 1:
+                        moves.append(get_move((r, c), (r - 2, c), self.board))
+            for d_col in (1, -1):
+                if self.in_bounds(r-1, c+d_col) and (not piece_pinned or pin_direction == (-1, d_col)):
+                    if self.board[r-1][c+d_col][0] == 'b':
+                        if (check_mask >> ((r - 1) * 8 + c + d_col)) & 1:
+                            moves.append(get_move((r, c), (r - 1, c + d_col), self.board))
+                    elif (r - 1, c + d_col) == self.possible_en_passant:
+                        # en passant can also stop a check by taking the checking pawn beside it
+                        if (check_mask >> ((r - 1) * 8 + c + d_col)) & 1 or (check_mask >> (r * 8 + c + d_col)) & 1:
+                            if self.en_passant_is_legal(r, c, c + d_col):
+                                moves.append(get_move((r, c), (r - 1, c + d_col), self.board, is_en_passant=True))
         if not self.white_to_move:
-            king_row, king_col = self.bK_pos
             if self.board[r+1][c] == "--":
-                if not piece_pinned or pin_direction == (1, 0):
-                    moves.append(Move((r, c), (r + 1, c), self.board))
-                    if r == 1 and self.board[r+2][c] == "--":
-                        moves.append(Move((r, c), (r + 2, c), self.board))
-            if self.in_bounds(r+1, c+1):
-                if self.board[r+1][c+1][0] == 'w':
-                    if not piece_pinned or pin_direction == (1, 1):
-                        moves.append(Move((r, c), (r + 1, c + 1), self.board))
-                elif (r + 1, c + 1) == self.possible_en_passant:
-                    moves.append(Move((r, c), (r + 1, c + 1), self.board, is_en_passant=True))
-            if self.in_bounds(r+1, c-1):
-                if self.board[r+1][c-1][0] == 'w':
-                    if not piece_pinned or pin_direction == (1, -1):    
-                        moves.append(Move((r, c), (r + 1, c - 1), self.board))
-                elif (r + 1, c - 1) == self.possible_en_passant:
-                        moves.append(Move((r, c), (r + 1, c - 1), self.board, is_en_passant=True))
+                if not piece_pinned or pin_direction in ((1, 0), (-1, 0)):
+                    if (check_mask >> ((r + 1) * 8 + c)) & 1:
+                        moves.append(get_move((r, c), (r + 1, c), self.board))
+                    if r == 1 and self.board[r+2][c] == "--" and (check_mask >> ((r + 2) * 8 + c)) & 1:
+                        moves.append(get_move((r, c), (r + 2, c), self.board))
+            for d_col in (1, -1):
+                if self.in_bounds(r+1, c+d_col) and (not piece_pinned or pin_direction == (1, d_col)):
+                    if self.board[r+1][c+d_col][0] == 'w':
+                        if (check_mask >> ((r + 1) * 8 + c + d_col)) & 1:
+                            moves.append(get_move((r, c), (r + 1, c + d_col), self.board))
+                    elif (r + 1, c + d_col) == self.possible_en_passant:
+                        # en passant can also stop a check by taking the checking pawn beside it
+                        if (check_mask >> ((r + 1) * 8 + c + d_col)) & 1 or (check_mask >> (r * 8 + c + d_col)) & 1:
+                            if self.en_passant_is_legal(r, c, c + d_col):
+                                moves.append(get_move((r, c), (r + 1, c + d_col), self.board, is_en_passant=True))
         return moves
 
 
 
 
+    def en_passant_is_legal(self, r, c, capture_col):
+        """
+        Checks that capturing en passant from (r, c) does not leave the king in check. Both pawns
+        leave the rank at once, which the pin scan cannot see. Returns a boolean value.
+        """
+        end_row = r - 1 if self.white_to_move else r + 1
+        pawn = self.board[r][c]
+        captured = self.board[r][capture_col]
+        self.board[r][c] = "--" # trying the capture on the board and looking for checks
+        self.board[r][capture_col] = "--"
+        self.board[end_row][capture_col] = pawn
+        king_row, king_col = self.wK_pos if self.white_to_move else self.bK_pos
+        in_check = self.is_square_attacked(king_row, king_col, 'b' if self.white_to_move else 'w')
+        self.board[r][c] = pawn
+        self.board[r][capture_col] = captured
+        self.board[end_row][capture_col] = "--"
+        return not in_check
+
+
+
+
     def get_rook_moves(self, r, c, moves):
         """
         A function to add possible moves specific for a rook in a given position to a 
         given list [moves]. Returns the updated list of moves.
         """
-        piece_pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins)-1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piece_pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                if self.board[r][c][1] != 'Q':
-                    self.pins.remove(self.pins[i])
-                break
-        directions = ((1, 0), (-1, 0), (0, 1), (0, -1))
-        for d in directions:
-            new_r = r + d[0]
-            new_c = c + d[1]
-            while self.in_bounds(new_r, new_c):
-                if not piece_pinned or pin_direction == (d[0], d[1]) or pin_direction == (-d[0], -d[1]):
-                    if self.board[new_r][new_c] == "--":
-                        moves.append(Move((r, c), (new_r, new_c), self.board))
-                    turn = self.board[new_r][new_c][0]
-                    if (turn == 'w' and self.white_to_move) or (turn == 'b' and not self.white_to_move):
-                        break
-                    elif (turn == 'w' and not self.white_to_move) or (turn == 'b' and self.white_to_move):
-                        moves.append(Move((r, c), (new_r, new_c), self.board))
-                        break
-                    new_r += d[0]
-                    new_c += d[1]
-                else:
-                    break
-        return moves
+        return self.get_slider_moves(r, c, moves, ROOK_DIRECTIONS)
 
 
 
@@ -331,22 +688,16 @@ class GameState:
         A function to add possible moves specific for a knight in a given position to a 
         given list [moves]. Returns the updated list of moves.
         """
-        piece_pinned = False
-        for i in range(len(self.pins)-1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piece_pinned = True
-                self.pins.remove(self.pins[i])
-                break
-        directions = ((2, 1), (2, -1), (-2, 1), (-2, -1), (1, 2), (1, -2), (-1, 2), (-1, -2))
-        for d in directions:
+        if (r, c) in self.pin_directions: # a pinned knight can never move
+            return moves
+        check_mask = self.check_mask
+        ally = 'w' if self.white_to_move else 'b'
+        for d in KNIGHT_STEPS:
             new_r = r + d[0]
             new_c = c + d[1]
             if self.in_bounds(new_r, new_c):
-                if piece_pinned:
-                    return moves
-                else:
-                    if self.board[new_r][new_c][0] != ('w' if self.white_to_move else 'b'):
-                        moves.append(Move((r, c), (new_r, new_c), self.board))
+                if self.board[new_r][new_c][0] != ally and (check_mask >> (new_r * 8 + new_c)) & 1:
+                    moves.append(get_move((r, c), (new_r, new_c), self.board))
         return moves
 
 
@@ -357,32 +708,35 @@ class GameState:
         A function to add possible moves specific for a bishop in a given position to a 
         given list [moves]. Returns the updated list of moves.
         """
-        piece_pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins)-1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piece_pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
-        directions = ((1, 1), (1, -1), (-1, 1), (-1, -1))
+        return self.get_slider_moves(r, c, moves, BISHOP_DIRECTIONS)
+
+
+
+
+    def get_slider_moves(self, r, c, moves, directions):
+        """
+        Adds the moves of a rook, bishop or queen sliding in the given directions, keeping a 
+        pinned piece on the line of its pin and, in check, only stopping on squares that stop
+        the check. Returns the updated list of moves.
+        """
+        pin_direction = self.pin_directions.get((r, c))
+        check_mask = self.check_mask
+        ally = 'w' if self.white_to_move else 'b'
         for d in directions:
+            if pin_direction is not None and pin_direction != d and pin_direction != (-d[0], -d[1]):
+                continue
             new_r = r + d[0]
             new_c = c + d[1]
             while self.in_bounds(new_r, new_c):
-                if not piece_pinned or pin_direction == (d[0], d[1]) or pin_direction == (-d[0], -d[1]):
-                    if self.board[new_r][new_c] == "--":
-                        moves.append(Move((r, c), (new_r, new_c), self.board))
-                    turn = self.board[new_r][new_c][0]
-                    if (turn == 'w' and self.white_to_move) or (turn == 'b' and not self.white_to_move):
-                        break
-                    elif (turn == 'w' and not self.white_to_move) or (turn == 'b' and self.white_to_move):
-                        moves.append(Move((r, c), (new_r, new_c), self.board))
-                        break
-                    new_r += d[0]
-                    new_c += d[1]
-                else: 
+                turn = self.board[new_r][new_c][0]
+                if turn == ally:
                     break
+                if (check_mask >> (new_r * 8 + new_c)) & 1:
+                    moves.append(get_move((r, c), (new_r, new_c), self.board))
+                if turn != '-': # captured an enemy piece
+                    break
+                new_r += d[0]
+                new_c += d[1]
         return moves
 
 
@@ -402,110 +756,149 @@ class GameState:
 
     def get_king_moves(self, r, c, moves):
         """
-        A function to add possible king moves in a given position. 
+        A function to add possible king moves in a given position. The squares the enemy attacks
+        are looked up in an attack map, built once for the king and castling moves.
         """
-        directions = ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1))
         if self.white_to_move:
             ally = 'w'
+            enemy = 'b'
         else:
             ally = 'b'
-        for d in directions:
+            enemy = 'w'
+        attacked = self.get_attack_map(enemy)
+        for d in KING_STEPS:
             new_r = r + d[0]
             new_c = c + d[1]
             if self.in_bounds(new_r, new_c):
-                if self.white_to_move and self.board[new_r][new_c][0] != ally:
-                    self.wK_pos = (new_r, new_c)
-                elif not self.white_to_move and self.board[new_r][new_c][0] != ally:
-                    self.bK_pos = (new_r, new_c)
-                in_check, pins, checks = self.find_pins_checks()
-                if not in_check and self.board[new_r][new_c][0] != ally:
-                    moves.append(Move((r, c), (new_r, new_c), self.board))
-                    if self.white_to_move:
-                        self.wK_pos = (r, c)
-                    else:
-                        self.bK_pos = (r, c)
-                else:
-                    if self.white_to_move:
-                        self.wK_pos = (r, c)
-                    else:
-                        self.bK_pos = (r, c)
-        moves = self.get_castle_moves(r, c, moves, ally)
+                if self.board[new_r][new_c][0] != ally and not (attacked >> (new_r * 8 + new_c)) & 1:
+                    moves.append(get_move((r, c), (new_r, new_c), self.board))
+        moves = self.get_castle_moves(r, c, moves, ally, attacked)
         return moves
     
 
 
 
-    def get_castle_moves(self, r, c, moves, ally):
+    def get_castle_moves(self, r, c, moves, ally, attacked):
         """
-        Gets all castle moves available to the current king
+        Gets all castle moves available to the current king, given the attack map of the enemy
         """
-        in_check, pins, checks = self.find_pins_checks()
-        if in_check:
-            return
+        if (attacked >> (r * 8 + c)) & 1: # cannot castle out of check
+            return moves
         else:
-            if (self.white_to_move and self.current_castle_rights.wks == True) or (not self.white_to_move and self.current_castle_rights.bks == True):
-                moves = self.get_kingside(r, c, moves, checks, ally)
-            if (self.white_to_move and self.current_castle_rights.wqs == True) or (not self.white_to_move and self.current_castle_rights.bqs == True):
-                moves = self.get_queenside(r, c, moves, checks, ally)
+            if self.castle_rights & (WKS if self.white_to_move else BKS):
+                moves = self.get_kingside(r, c, moves, attacked, ally)
+            if self.castle_rights & (WQS if self.white_to_move else BQS):
+                moves = self.get_queenside(r, c, moves, attacked, ally)
         return moves
 
 
 
 
-    def get_kingside(self, r, c, moves, checks, ally):
+    def get_kingside(self, r, c, moves, attacked, ally):
         """
         Gets kingside castle moves for both black and white. Returns the updated moves list
         """
         if self.board[r][c+1] == "--" and self.board[r][c+2] == "--":
-            add = True
-            for check in checks:
-                if (r == check[0] and c+1 == check[1]) or (r == check[0] and c+2 == check[1]):
-                    add = False
-            if add:
-                if self.current_castle_rights.wks and ally == 'w':
-                    self.wK_pos = (r, c+2)
-                    in_check, pins, checks = self.find_pins_checks()
-                    if not in_check:
-                        moves.append(Move((r, c), (r, c+2), self.board, is_castle_move=True))
-                    self.wK_pos = (r, c)
-                if self.current_castle_rights.bks and ally == 'b': 
-                    self.bK_pos = (r, c+2)
-                    in_check, pins, checks = self.find_pins_checks()
-                    if not in_check:
-                        moves.append(Move((r, c), (r, c+2), self.board, is_castle_move=True))
-                    self.bK_pos = (r, c)       
+            # the king cannot pass through check either
+            if not (attacked >> (r * 8 + c + 1)) & 1 and not (attacked >> (r * 8 + c + 2)) & 1:
+                moves.append(get_move((r, c), (r, c+2), self.board, is_castle_move=True))
         return moves
 
 
 
 
-    def get_queenside(self, r, c, moves, checks, ally):
+    def get_queenside(self, r, c, moves, attacked, ally):
         """
         Gets queenside castle moves for both black and white. Returns the updated moves list
         """
-        if self.board[r][c-1] == "--" and self.board[r][c-2] == "--" and self.board[r][c-3]:
-            add = True
-            for check in checks:
-                if (r == check[0] and c-1 == check[1]) or (r == check[0] and c-2 == check[1]):
-                    add = False
-            if add:
-                if self.current_castle_rights.wqs and ally == 'w':
-                    self.wK_pos = (r, c-2)
-                    in_check, pins, checks = self.find_pins_checks()
-                    if not in_check:
-                        moves.append(Move((r, c), (r, c-2), self.board, is_castle_move=True))
-                    self.wK_pos = (r, c)
-                if self.current_castle_rights.bqs and ally == 'b': 
-                    self.bK_pos = (r, c-2)
-                    in_check, pins, checks = self.find_pins_checks()
-                    if not in_check:
-                        moves.append(Move((r, c), (r, c-2), self.board, is_castle_move=True))
-                    self.bK_pos = (r, c)
+        if self.board[r][c-1] == "--" and self.board[r][c-2] == "--" and self.board[r][c-3] == "--":
+            # the king cannot pass through check either
+            if not (attacked >> (r * 8 + c - 1)) & 1 and not (attacked >> (r * 8 + c - 2)) & 1:
+                moves.append(get_move((r, c), (r, c-2), self.board, is_castle_move=True))
         return moves
 
 
 
 
+    def is_square_attacked(self, r, c, by_color):
+        """
+        Checks if the square (r, c) is attacked by a piece of one color ('w' or 'b') by looking 
+        out from the square for each kind of attacker. The king of the other color does not 
+        block, so a king cannot step back along the line of a check. Returns a boolean value.
+        """
+        if self.bitboards is not None:
+            bbs = self.bitboards
+            by = bitboard.WHITE if by_color == 'w' else bitboard.BLACK
+            king = bbs.pieces[(1 - by) * 6 + bitboard.KING]
+            return bbs.is_attacked(r * 8 + c, by, (bbs.colors[0] | bbs.colors[1]) & ~king)
+        board = self.board
+        other_king = ('b' if by_color == 'w' else 'w') + 'K'
+        for steps, attacker in ((KNIGHT_STEPS, by_color + 'N'), (KING_STEPS, by_color + 'K')):
+            for d in steps:
+                end_row = r + d[0]
+                end_col = c + d[1]
+                if self.in_bounds(end_row, end_col) and board[end_row][end_col] == attacker:
+                    return True
+        pawn_row = r + 1 if by_color == 'w' else r - 1 # white pawns attack up the board
+        for end_col in (c - 1, c + 1):
+            if self.in_bounds(pawn_row, end_col) and board[pawn_row][end_col] == by_color + 'P':
+                return True
+        for directions, attacker in ((ROOK_DIRECTIONS, by_color + 'R'), (BISHOP_DIRECTIONS, by_color + 'B')):
+            for d in directions:
+                end_row = r + d[0]
+                end_col = c + d[1]
+                while self.in_bounds(end_row, end_col):
+                    piece = board[end_row][end_col]
+                    if piece != "--" and piece != other_king:
+                        if piece == attacker or piece == by_color + 'Q':
+                            return True
+                        break
+                    end_row += d[0]
+                    end_col += d[1]
+        return False
+
+
+
+
+    def get_attack_map(self, by_color):
+        """
+        Gets every square attacked by the pieces of one color ('w' or 'b'). As in 
+        is_square_attacked, the king of the other color does not block. Returns an integer with 
+        bit (row * 8 + col) set for each attacked square.
+        """
+        if self.bitboards is not None:
+            bbs = self.bitboards
+            by = bitboard.WHITE if by_color == 'w' else bitboard.BLACK
+            king = bbs.pieces[(1 - by) * 6 + bitboard.KING]
+            return bbs.attack_map(by, (bbs.colors[0] | bbs.colors[1]) & ~king)
+        board = self.board
+        other_king = ('b' if by_color == 'w' else 'w') + 'K'
+        pawn_steps = ((-1, -1), (-1, 1)) if by_color == 'w' else ((1, -1), (1, 1))
+        attacked = 0
+        for (r, c), piece in self.piece_squares[by_color].items():
+            if piece[1] in "PNK": # pieces that step
+                steps = pawn_steps if piece[1] == 'P' else KNIGHT_STEPS if piece[1] == 'N' else KING_STEPS
+                for d in steps:
+                    end_row = r + d[0]
+                    end_col = c + d[1]
+                    if self.in_bounds(end_row, end_col):
+                        attacked |= 1 << (end_row * 8 + end_col)
+                continue
+            directions = ROOK_DIRECTIONS if piece[1] == 'R' else BISHOP_DIRECTIONS if piece[1] == 'B' else KING_STEPS
+            for d in directions: # pieces that slide
+                end_row = r + d[0]
+                end_col = c + d[1]
+                while self.in_bounds(end_row, end_col):
+                    attacked |= 1 << (end_row * 8 + end_col)
+                    if board[end_row][end_col] != "--" and board[end_row][end_col] != other_king:
+                        break
+                    end_row += d[0]
+                    end_col += d[1]
+        return attacked
+
+
+
+
     def find_pins_checks(self):
         pins = []
         checks = []
@@ -577,6 +970,9 @@ class CastleRights:
 
 class Move:
 
+    __slots__ = ("start_row", "start_col", "end_row", "end_col", "piece_moved", "piece_captured", 
+                 "pawn_promotion", "en_passant", "castle", "move_id", "code")
+
     ranks_to_rows = {"1": 7, "2": 6, "3": 5, "4": 4,
                      "5": 3, "6": 2, "7": 1, "8": 0}
     rows_to_ranks = {v: k for k, v in ranks_to_rows.items()}
@@ -584,6 +980,10 @@ class Move:
                      "e": 4, "f": 5, "g": 6, "h": 7}
     cols_to_files = {v: k for k, v in files_to_cols.items()}
 
+    # Moves by code. A Move is never changed once it is built, so the move generators hand out 
+    # the same object every time a move comes up instead of building a new one
+    pool = {}
+
 
 
     def __init__(self, start, end, board, is_en_passant=False, is_castle_move=False):
@@ -597,13 +997,41 @@ class Move:
         self.pawn_promotion = (self.piece_moved == "wP" and self.end_row == 0) or (self.piece_moved == "bP" and self.end_row == 7)
         # en passant
         self.en_passant = is_en_passant
+        if is_en_passant: # the captured pawn is beside the moving pawn, not on the end square
+            self.piece_captured = "bP" if self.piece_moved == "wP" else "wP"
         # castle
         self.castle = is_castle_move
 
         self.move_id = self.start_row * 1000 + self.start_col * 100 + self.end_row * 10 + self.end_col
+        self.code = encode_move(self.start_row * 8 + self.start_col, self.end_row * 8 + self.end_col, 
+                                self.piece_moved, self.piece_captured, is_en_passant, is_castle_move)
+
 
 
 
+    @staticmethod
+    def from_code(code):
+        """
+        Gets the Move for a code made by encode_move, from the pool if it has been built before.
+        Returns the Move.
+        """
+        move = Move.pool.get(code)
+        if move is None:
+            move = Move.__new__(Move)
+            start = code & 63
+            end = (code >> 6) & 63
+            move.start_row, move.start_col = divmod(start, 8)
+            move.end_row, move.end_col = divmod(end, 8)
+            move.piece_moved = PIECE_NAMES[(code >> 12) & 15]
+            move.piece_captured = PIECE_NAMES[(code >> 16) & 15]
+            move.pawn_promotion = (move.piece_moved == "wP" and move.end_row == 0) or (move.piece_moved == "bP" and move.end_row == 7)
+            move.en_passant = code >> 20 == bitboard.EN_PASSANT
+            move.castle = code >> 20 == bitboard.CASTLE
+            move.move_id = move.start_row * 1000 + move.start_col * 100 + move.end_row * 10 + move.end_col
+            move.code = code
+            Move.pool[code] = move
+        return move
+
 
 
     def __eq__(self, other):
@@ -629,5 +1057,16 @@ class Move:
 
 
 
+    def get_uci_notation(self):
+        """
+        Gets the move in the notation of the UCI protocol, like e2e4, or e7e8q for a promotion 
+        (always to a queen in this engine). Castling is the king's move, like e1g1.
+        """
+        notation = self.get_rank_file(self.start_row, self.start_col) + self.get_rank_file(self.end_row, self.end_col)
+        return notation + "q" if self.pawn_promotion else notation
+
+
+
+
     def get_rank_file(self, r, c):
         return self.cols_to_files[c] + self.rows_to_ranks[r]
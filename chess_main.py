@@ -1,3 +1,4 @@
+from functools import lru_cache
 import pygame as p
 import chess_engine
 import so_smart as ai
@@ -9,30 +10,65 @@ FONT_SIZE = HEIGHT // 40
 DIMENSION = 8
 SQ_DIM = HEIGHT // DIMENSION
 MAX_FPS = 60
+AI_THINK_TIME = 5 # seconds the AI may spend searching a move
+AI_MAX_DEPTH = ai.MAX_PLY # deep enough that the think time is what stops the search
+PONDER = True # If true, the AI keeps searching while the human thinks
 IMAGES = {}
+FONTS = {} # loaded fonts by (style, size)
+LINE_HEIGHT = FONT_SIZE * RATIO # space between lines of the move log
+center_piece = SQ_DIM * 0.075 # offset of a piece image inside its square
+center_highlight = SQ_DIM * 0.05 # offset of a selection highlight inside its square
+board_surface = None # the empty board, drawn once by draw_board
+drawn_looks = [None] * (DIMENSION * DIMENSION) # what each square showed when it was last drawn
+dirty_rects = [] # parts of the screen drawn over since the last display update
+log_surface = None # the move log panel, kept between calls to draw_text
+log_lines = [] # the text shown on each line of the log panel, newest on top
 
 def load_images():
+    """
+    Loads the piece images scaled to the squares. The scaled images are saved side by side in one
+    atlas per square size, so later starts load one small file instead of loading and scaling 12.
+    """
     pieces = ["bB", "bK", "bN", "bP", "bQ", "bR", "wB", "wK", "wN", "wP", "wQ", "wR",]
-    for piece in pieces:
-        IMAGES[piece] = p.transform.scale(p.image.load("images/" + piece + ".png"), (SQ_DIM * 0.85, SQ_DIM * 0.85))
+    size = int(SQ_DIM * 0.85)
+    atlas_path = "images/atlas_" + str(SQ_DIM) + ".png"
+    try:
+        atlas = p.image.load(atlas_path)
+    except (FileNotFoundError, p.error): # first start at this square size, building the atlas
+        atlas = p.Surface((size * len(pieces), size), p.SRCALPHA)
+        for i, piece in enumerate(pieces): # copying the pixels and their alpha as they are, not blending
+            atlas.blit(p.transform.scale(p.image.load("images/" + piece + ".png"), (size, size)), (i * size, 0), special_flags=p.BLEND_RGBA_MAX)
+        try:
+            p.image.save(atlas, atlas_path)
+        except (OSError, p.error): # the images folder is read only, building it again next time
+            pass
+    atlas = atlas.convert_alpha()
+    for i, piece in enumerate(pieces):
+        IMAGES[piece] = atlas.subsurface(p.Rect(i * size, 0, size, size))
 
 def main():
     p.init()
     screen = p.display.set_mode((WIDTH, HEIGHT))
     clock = p.time.Clock()
     screen.fill(p.Color("white"))
-    gs = chess_engine.GameState()
+    dirty_rects.append(screen.get_rect())
+    gs = chess_engine.GameState(use_bitboards=True)
     valid_moves = gs.get_valid_moves()
     move_made = False # tracking if we have made a move or not
     animate = False # tracking if we need to animate a move or not
     line_count = 1
     load_images()
+    draw_board(screen) # drawing the board once, then only the squares that change
     sq_selected = ()
     clicks = []
     running = True
     game_over = False
+    ai_moved = False # the AI made the last move, so it can ponder on the human's reply
     player_one = True # If true, human will play as white
     player_two = True # If true, human will play as black
+    engine = None # the AI searches in another process so the window never freezes, only started if it plays
+    if not (player_one and player_two):
+        engine = ai.BackgroundSearch()
     while running: 
         human_move = (gs.white_to_move and player_one) or (not gs.white_to_move and player_two)
         for e in p.event.get():
@@ -67,11 +103,14 @@ def main():
             elif e.type == p.KEYDOWN: # registering keyboard clicks
                 key_pressed = p.key.get_pressed()
                 if key_pressed[p.K_u]: # [U] key, undo a move
+                    ai_thinking = engine is not None and engine.thinking
+                    if engine is not None:
+                        engine.cancel()
                     if gs.move_log == []: # empty move log
                         draw_text(screen, gs, line_count, "No moves made.")
                         break
                     gs.undo_move() # setting move_made flag as true, not animate though (looks funky)
-                    if player_one ^ player_two: # undoing move made by ai as well if one human is playing
+                    if player_one ^ player_two and not ai_thinking: # undoing move made by ai as well if one human is playing
                         gs.undo_move()
                         line_count -= 1
                     line_count -= 1 # line count goes down since it is an undo, and since a move has been removed from the move log
@@ -81,33 +120,41 @@ def main():
                     clicks = []
                     game_over = False # in case of checkmate / stalemate
                 if key_pressed[p.K_r]: # [R] clicked, resetting game
+                    if engine is not None:
+                        engine.cancel()
                     line_count = 1 # line count starts at beginning again
                     draw_text(screen, gs, line_count, "New game.")
-                    gs = chess_engine.GameState() # new GameState object with fresh flags and properties
+                    gs = chess_engine.GameState(use_bitboards=True) # new GameState object with fresh flags and properties
                     valid_moves = gs.get_valid_moves()
                     sq_selected = ()
                     clicks = []
                     move_made = False
                     animate = False
                     game_over = False
-        # AI move finder
-        if not game_over and not human_move:
-            next_move = ai.find_best_move(gs, valid_moves)
-            if next_move == None:
-                next_move = ai.find_random_move(valid_moves)
-            text = next_move.get_chess_notation()
-            draw_text(screen, gs, line_count, text) # updating the move log shown on the right side of the screen
-            if line_count + (FONT_SIZE * RATIO) + (FONT_SIZE * 2) < HEIGHT: # moving the next line down if there is room
-                line_count += 1 
-            gs.make_move(next_move) # making the move and setting flags
-            move_made = True
-            animate = True
+        # AI move finder, the search runs in the background and is checked once per frame
+        if not game_over and not human_move and engine.thinking:
+            next_move = engine.poll()
+            if next_move is not None:
+                text = next_move.get_chess_notation()
+                draw_text(screen, gs, line_count, text) # updating the move log shown on the right side of the screen
+                if line_count + (FONT_SIZE * RATIO) + (FONT_SIZE * 2) < HEIGHT: # moving the next line down if there is room
+                    line_count += 1 
+                gs.make_move(next_move) # making the move and setting flags
+                move_made = True
+                animate = True
+                ai_moved = True
         if move_made: # move has been made or undone
             move_made = False 
             if animate: # animating a move
                 animate_piece(next_move, screen, gs.board, clock)
                 animate = False
             valid_moves = gs.get_valid_moves() # new set of valid moves
+            if len(valid_moves) > 0: # checkmate and stalemate are handled below
+                repetition = gs.is_repetition(2)
+                if repetition or gs.is_fifty_move_draw(): # the same position three times, or fifty moves without a capture or pawn move
+                    reason = "repetition" if repetition else "the fifty-move rule"
+                    draw_text(screen, gs, line_count, f"Draw by {reason}. Please press [R] to restart or [U] to undo.")
+                    game_over = True
         if gs.checkmate or gs.stalemate: # displaying a prompt to get out of checkmate / stalemate
             if gs.white_to_move:
                 turn = "black"
@@ -117,52 +164,130 @@ def main():
             game_over = True # game is over
             gs.checkmate = False #setting these to false so it does not constantly run
             gs.stalemate = False
-        draw_game_state(screen, gs, valid_moves, sq_selected) # draw GameState after everything has been changed
+        # the AI only starts thinking once the position is known not to end the game
+        human_move = (gs.white_to_move and player_one) or (not gs.white_to_move and player_two)
+        if not game_over and not human_move and not engine.thinking:
+            engine.search(gs, AI_THINK_TIME, AI_MAX_DEPTH)
+        elif not game_over and human_move and ai_moved and PONDER:
+            engine.ponder(gs, AI_MAX_DEPTH) # thinking on the human's time, until the human moves
+        ai_moved = False
+        dirty_rects.extend(draw_game_state(screen, gs, valid_moves, sq_selected)) # draw GameState after everything has been changed
         clock.tick(MAX_FPS)
-        p.display.flip()
+        p.display.update(dirty_rects) # only the parts of the screen that changed
+        dirty_rects.clear()
+    if engine is not None:
+        engine.close()
+
+def get_font(style, size):
+    """
+    Loads a font from the fonts folder the first time it is asked for.
+    """
+    if (style, size) not in FONTS:
+        FONTS[(style, size)] = p.font.Font("fonts/" + style + ".ttf", size)
+    return FONTS[(style, size)]
+
+@lru_cache(maxsize=512)
+def render_text(text, style="cherry"):
+    """
+    Renders a line of the move log. Notation repeats a lot, so the most recent renders are kept.
+    """
+    return get_font(style, FONT_SIZE).render(text, True, p.Color("black"))
 
 def draw_text(screen, gs, line_count, text, style="cherry", bold=False):
-    text_surface = p.Surface((WIDTH * (RATIO - 1), HEIGHT)) # portion of the screen not on the board
-    text_surface.fill(p.Color("white"))
-    font = p.font.Font("fonts/" + style + ".ttf", FONT_SIZE)
-    j = 1 # iterator for the history_location
-    for i in range(-1, -(line_count), -1): # for loop to print a move log. newest appears on top. starts on second line
-        history_obj = font.render(gs.move_log[i].get_chess_notation(), True, p.Color("black"))
-        history_location = p.Rect(0, (FONT_SIZE * RATIO * j), WIDTH * (RATIO - 1), FONT_SIZE + (FONT_SIZE * RATIO))
-        text_surface.blit(history_obj, history_location)
-        j += 1
-    text_obj = font.render(text, True, p.Color("black")) # final information displayed in the log (could be move notation, move undone, or game over update)
-    text_location = p.Rect(0, 0, WIDTH * (RATIO - 1), FONT_SIZE + (FONT_SIZE * RATIO))
-    text_surface.blit(text_obj, text_location)
-    screen.blit(text_surface, (HEIGHT, 0))
+    """
+    Shows text on the first line of the log panel and the last moves below it, newest on top.
+    When a move is added the old lines are scrolled down a line, and only lines whose text
+    changed are drawn again.
+    """
+    global log_surface
+    changed = None # part of the panel drawn over
+    if log_surface is None:
+        log_surface = p.Surface((WIDTH * (RATIO - 1), HEIGHT)) # portion of the screen not on the board
+        log_surface.fill(p.Color("white"))
+        changed = log_surface.get_rect()
+    shown = min(line_count, int(HEIGHT // LINE_HEIGHT) + 1) # lines past the bottom of the panel are not drawn
+    # final information displayed in the log (could be move notation, move undone, or game over update), then the move log
+    lines = [text] + [gs.move_log[i].get_chess_notation() for i in range(-1, -(shown), -1)]
+    if len(lines) > 1 and lines[1:] == log_lines[:len(lines) - 1]: # one line added on top, moving the rest down
+        log_surface.scroll(0, int(LINE_HEIGHT))
+        log_lines.insert(0, None)
+        changed = log_surface.get_rect()
+    for j in range(max(len(lines), len(log_lines))):
+        line = lines[j] if j < len(lines) else None
+        if j < len(log_lines) and log_lines[j] == line:
+            continue
+        band = p.Rect(0, int(LINE_HEIGHT * j), log_surface.get_width(), int(LINE_HEIGHT))
+        log_surface.fill(p.Color("white"), band)
+        if line is not None:
+            log_surface.blit(render_text(line, style), band)
+        changed = band if changed is None else changed.union(band)
+    log_lines[:] = lines
+    if changed is not None: # only the part of the panel that changed is put on the screen
+        dirty_rects.append(screen.blit(log_surface, changed.move(HEIGHT, 0), changed))
 
-def highlight_squares(screen, gs, valid_moves, sq_selected):
+def square_looks(gs, valid_moves, sq_selected):
+    """
+    Works out what each square should show: (piece, last move highlight, selection highlight),
+    where the last move highlight is 2 on its end square and 1 on its start square, and the
+    selection highlight is "selected" on the selected piece and "target" on its valid moves.
+    """
+    looks = [[piece, 0, None] for row in gs.board for piece in row]
+    if gs.move_log != []: # highlighting last move made
+        last_move = gs.move_log[-1]
+        looks[last_move.end_row * DIMENSION + last_move.end_col][1] = 2
+        looks[last_move.start_row * DIMENSION + last_move.start_col][1] = 1
     if sq_selected != (): # one square selected
         r, c = sq_selected
         if gs.board[r][c][0] == ('w' if gs.white_to_move else 'b'): # checking it was a valid piece to select
-            center_highlight = SQ_DIM*0.05 # setting up highlights
-            s = p.Surface((SQ_DIM * 0.90, SQ_DIM * 0.90)) 
-            s.set_alpha(80) # transparency value (0 - 255)
-            s.fill(p.Color("yellow"))
-            screen.blit(s, (c * SQ_DIM + center_highlight, r * SQ_DIM + center_highlight)) # highlighting square of piece selected
-            s.fill(p.Color("grey"))
+            looks[r * DIMENSION + c][2] = "selected"
             for move in valid_moves: # hightlighting all valid moves for the piece selected
                 if move.start_row == r and move.start_col == c:
-                    end_r = move.end_row
-                    end_c = move.end_col
-                    screen.blit(s, (end_c * SQ_DIM + center_highlight, end_r * SQ_DIM + center_highlight))
+                    looks[move.end_row * DIMENSION + move.end_col][2] = "target"
+    return [tuple(look) for look in looks]
 
 def draw_game_state(screen, gs, valid_moves, sq_selected):
-    draw_board(screen, gs.move_log)
-    highlight_squares(screen, gs, valid_moves, sq_selected) # doing this before pieces so pieces are not highlighted
-    draw_pieces(screen, gs.board)
+    """
+    Redraws only the squares whose piece or highlights changed since they were last drawn.
+    Returns the list of rects drawn over.
+    """
+    rects = []
+    for sq, look in enumerate(square_looks(gs, valid_moves, sq_selected)):
+        if look != drawn_looks[sq]:
+            rects.append(draw_square(screen, sq // DIMENSION, sq % DIMENSION, look))
+            drawn_looks[sq] = look
+    return rects
+
+def draw_square(screen, r, c, look):
+    """
+    Draws one square from the cached board with its highlights and piece. Returns its rect.
+    """
+    piece, last_move, selection = look
+    square = p.Rect(c * SQ_DIM, r * SQ_DIM, SQ_DIM, SQ_DIM)
+    screen.blit(board_surface, square, square)
+    if last_move:
+        s = p.Surface((SQ_DIM, SQ_DIM))
+        s.set_alpha(80 if last_move == 2 else 40)
+        s.fill(p.Color("yellow"))
+        screen.blit(s, square)
+    if selection is not None: # doing this before pieces so pieces are not highlighted
+        s = p.Surface((SQ_DIM * 0.90, SQ_DIM * 0.90)) 
+        s.set_alpha(80) # transparency value (0 - 255)
+        s.fill(p.Color("yellow" if selection == "selected" else "grey"))
+        screen.blit(s, (c * SQ_DIM + center_highlight, r * SQ_DIM + center_highlight))
+    if piece != "--":
+        screen.blit(IMAGES[piece], (c * SQ_DIM + center_piece, r * SQ_DIM + center_piece))
+    return square
 
 def draw_board(screen, move_log=[]):
     global colors
+    global board_surface
     colors = [p.Color("darkseagreen2"), p.Color("darkseagreen3")] # light, dark, highlighted
-    for x in range(DIMENSION): # drawing pattern
-        for y in range(DIMENSION):
-            p.draw.rect(screen, colors[(x + y) % 2], p.Rect((x * SQ_DIM, y * SQ_DIM), (SQ_DIM, SQ_DIM)))
+    if board_surface is None: # drawing the pattern once and reusing it
+        board_surface = p.Surface((SQ_DIM * DIMENSION, SQ_DIM * DIMENSION))
+        for x in range(DIMENSION): # drawing pattern
+            for y in range(DIMENSION):
+                p.draw.rect(board_surface, colors[(x + y) % 2], p.Rect((x * SQ_DIM, y * SQ_DIM), (SQ_DIM, SQ_DIM)))
+    screen.blit(board_surface, (0, 0))
     s = p.Surface((SQ_DIM, SQ_DIM))
     s.set_alpha(80)
     s.fill(p.Color("yellow"))
@@ -172,8 +297,6 @@ def draw_board(screen, move_log=[]):
         screen.blit(s, (move_log[-1].start_col * SQ_DIM, move_log[-1].start_row * SQ_DIM))
 
 def draw_pieces(screen, board):
-    global center_piece
-    center_piece = SQ_DIM*0.075
     for x in range(DIMENSION): # drawing all pieces on correct squares
         for y in range(DIMENSION):
             piece = board[y][x]
@@ -182,25 +305,33 @@ def draw_pieces(screen, board):
 
 def animate_piece(move, screen, board, clock):
     global colors
-    global center_piece
     d_r = move.end_row - move.start_row # change in row and change in col
     d_c = move.end_col - move.start_col
     frames_per_sq = 10
     frame_count = (abs(d_r) + abs(d_c)) * frames_per_sq # total frames to be drawn
+    # drawing everything but the moving piece once, then only the piece moves over it
+    draw_board(screen)
+    draw_pieces(screen, board)
+    # erasing piece moved from end square until it gets there
+    color = colors[(move.end_row + move.end_col) % 2]
+    end_sq = p.Rect(move.end_col * SQ_DIM, move.end_row * SQ_DIM, SQ_DIM, SQ_DIM)
+    p.draw.rect(screen, color, end_sq)
+    # redrawing piece captured in end square
+    if move.piece_captured != "--":
+        screen.blit(IMAGES[move.piece_captured], (move.end_col * SQ_DIM + center_piece, move.end_row * SQ_DIM + center_piece))
+    background = screen.copy()
+    p.display.update(screen.get_rect())
+    piece_rect = None
     for frame in range(frame_count + 1): # drawing board for all frames
         r, c = (move.start_row + (d_r * frame / frame_count), move.start_col + (d_c * frame / frame_count)) # iteration frame location for piece image
-        draw_board(screen)
-        draw_pieces(screen, board)
-        # erasing piece moved from end square until it gets there
-        color = colors[(move.end_row + move.end_col) % 2]
-        end_sq = p.Rect(move.end_col * SQ_DIM, move.end_row * SQ_DIM, SQ_DIM, SQ_DIM)
-        p.draw.rect(screen, color, end_sq)
-        # redrawing piece captured in end square
-        if move.piece_captured != "--":
-            screen.blit(IMAGES[move.piece_captured], (move.end_col * SQ_DIM + center_piece, move.end_row * SQ_DIM + center_piece))
-        screen.blit(IMAGES[move.piece_moved], (c * SQ_DIM + center_piece, r * SQ_DIM + center_piece))
-        p.display.flip()
+        rects = []
+        if piece_rect is not None: # covering the piece where it was last frame
+            rects.append(screen.blit(background, piece_rect, piece_rect))
+        piece_rect = screen.blit(IMAGES[move.piece_moved], (c * SQ_DIM + center_piece, r * SQ_DIM + center_piece))
+        rects.append(piece_rect)
+        p.display.update(rects)
         clock.tick(120)
+    drawn_looks[:] = [None] * (DIMENSION * DIMENSION) # the board is drawn in full again next frame
 
 
 if __name__ == "__main__":
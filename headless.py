@@ -0,0 +1,82 @@
+"""
+The engine without the pygame front end, for scripts and worker processes that only need moves.
+Importing this imports neither pygame nor numpy, and the evaluation and attack tables are built
+once, when so_smart and bitboard are first imported.
+
+    python headless.py                                          # best move from the start
+    python headless.py --fen "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1" --depth 5
+    python headless.py --time 2 --deterministic
+    python headless.py --depth 5 --stats --stats-log search.jsonl
+"""
+import argparse
+import json
+import sys
+import time
+import chess_engine
+import so_smart
+
+
+def new_game(fen=None):
+    """
+    Starts a game from the starting position, or from a FEN string, with the bitboard move
+    generator. Returns the GameState.
+    """
+    return chess_engine.GameState(use_bitboards=True, fen=fen)
+
+
+def best_move(gs, max_depth=so_smart.MAX_DEPTH, time_limit=None, deterministic=False, tt=None, stats=None,
+              null_move=so_smart.NULL_MOVE, late_move_reductions=so_smart.LATE_MOVE_REDUCTIONS):
+    """
+    Searches the position with iterative deepening, to max_depth or until time_limit (seconds)
+    runs out. The table of so_smart.find_best_move is used when tt is not given, and the counters
+    and timers of the search are collected in stats if a so_smart.SearchStats is given. Null-move
+    pruning and late move reductions can be turned off (see so_smart.Search). Returns 
+    (move, score, depth, principal variation): the score is from the side to move's point of 
+    view, the principal variation is the list of moves expected from the position, and the move is 
+    None when the side to move has no moves.
+    """
+    valid_moves = gs.get_valid_moves()
+    if len(valid_moves) == 0:
+        return None, so_smart.score_board(gs) * (1 if gs.white_to_move else -1), 0, []
+    search = so_smart.Search(so_smart.get_transposition_table() if tt is None else tt, time_limit,
+                             deterministic=deterministic, stats=stats, null_move=null_move, 
+                             late_move_reductions=late_move_reductions)
+    move, score = so_smart.iterative_deepening(gs, valid_moves, search, max_depth)
+    return move, score, search.completed_depth, search.principal_variation
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find the best move of a position without the GUI.")
+    parser.add_argument("--fen", help="position to search (default: the starting position)")
+    parser.add_argument("--depth", type=int, 
+                        help=f"deepest iteration to search (default: {so_smart.MAX_DEPTH}, or no limit with --time)")
+    parser.add_argument("--time", type=float, help="seconds to search for")
+    parser.add_argument("--deterministic", action="store_true", help="give the same move every run")
+    parser.add_argument("--no-null-move", action="store_true", help="turn off null-move pruning")
+    parser.add_argument("--no-lmr", action="store_true", help="turn off late move reductions")
+    parser.add_argument("--stats", action="store_true", help="print the node counts, cutoff rates and phase times")
+    parser.add_argument("--stats-log", help="file to append a line of JSON stats to after each iteration")
+    args = parser.parse_args(argv)
+
+    gs = new_game(args.fen)
+    max_depth = args.depth
+    if max_depth is None: # with a time budget the search deepens until the time runs out
+        max_depth = so_smart.MAX_PLY if args.time is not None else so_smart.MAX_DEPTH
+    stats = so_smart.SearchStats(args.stats_log) if args.stats or args.stats_log else None
+    start = time.perf_counter()
+    move, score, depth, pv = best_move(gs, max_depth, args.time, args.deterministic, stats=stats, 
+                                   null_move=so_smart.NULL_MOVE and not args.no_null_move, 
+                                   late_move_reductions=so_smart.LATE_MOVE_REDUCTIONS and not args.no_lmr)
+    elapsed = time.perf_counter() - start
+    if move is None:
+        print("no moves, " + ("checkmate" if gs.checkmate else "stalemate"))
+        return 0
+    print(f"{move.get_chess_notation()} score {score} depth {depth} in {elapsed:.2f}s")
+    print("pv " + " ".join(played.get_chess_notation() for played in pv))
+    if args.stats:
+        print(json.dumps(stats.as_dict(), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""
+Perft: counts the leaf nodes of the move tree to a fixed depth. The counts of the standard test
+positions are known, so this checks the move generator (castling, en passant, promotions, pins)
+and measures its speed in nodes per second.
+
+    python perft.py                                  # every standard position to depth 3
+    python perft.py --position kiwipete --depth 4 --divide --workers 8
+    python perft.py --fen "8/8/8/8/8/8/8/K6k w - - 0 1" --depth 5 --array
+"""
+import argparse
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import chess_engine
+
+# standard test positions and their leaf counts by depth. Promotions are always to a queen in
+# this engine, so where under-promotions are possible the counts are lower than the usual tables
+POSITIONS = {
+    "start": (chess_engine.START_FEN,
+              [20, 400, 8902, 197281, 4865609]),
+    "kiwipete": ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+                 [48, 2039, 97862, 4074224]),
+    "position3": ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+                  [14, 191, 2812, 43238, 674624]),
+    "position4": ("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+                  [6, 228, 8087, 320802]),
+    "position5": ("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+                  [41, 1373, 54007, 1806790]),
+}
+
+
+def perft(gs, depth):
+    """
+    Counts the leaf nodes of the move tree from the current position to the given depth.
+    Returns the count.
+    """
+    moves = gs.get_valid_moves()
+    if depth <= 1:
+        return len(moves) if depth == 1 else 1
+    nodes = 0
+    for move in moves:
+        gs.make_move(move)
+        nodes += perft(gs, depth - 1)
+        gs.undo_move()
+    return nodes
+
+
+def perft_root_move(fen, use_bitboards, move_id, depth):
+    """
+    Counts the leaf nodes below one root move, for a worker process. Returns (notation, count).
+    """
+    gs = chess_engine.GameState(use_bitboards, fen)
+    move = [move for move in gs.get_valid_moves() if move.move_id == move_id][0]
+    gs.make_move(move)
+    return move.get_chess_notation(), perft(gs, depth - 1)
+
+
+def divide(fen, depth, use_bitboards=True, workers=1):
+    """
+    Counts the leaf nodes below each root move, split across a pool of worker processes when
+    workers is more than 1. Returns a list of (notation, count) in move generation order.
+    """
+    gs = chess_engine.GameState(use_bitboards, fen)
+    moves = gs.get_valid_moves()
+    if depth <= 1:
+        return [(move.get_chess_notation(), 1) for move in moves]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(perft_root_move, fen, use_bitboards, move.move_id, depth) for move in moves]
+            return [future.result() for future in futures]
+    results = []
+    for move in moves:
+        gs.make_move(move)
+        results.append((move.get_chess_notation(), perft(gs, depth - 1)))
+        gs.undo_move()
+    return results
+
+
+def run(name, fen, depth, expected=None, use_bitboards=True, workers=1, show_divide=False):
+    """
+    Runs perft on one position and prints the count, the speed and whether the count matches the
+    expected one. Returns False if it does not match.
+    """
+    start = time.perf_counter()
+    results = divide(fen, depth, use_bitboards, workers)
+    elapsed = time.perf_counter() - start
+    nodes = sum(count for notation, count in results)
+    if show_divide:
+        for notation, count in results:
+            print(f"  {notation}: {count}")
+    status = ""
+    if expected is not None:
+        status = "ok" if nodes == expected else f"MISMATCH, expected {expected}"
+    print(f"{name} depth {depth}: {nodes} nodes in {elapsed:.2f}s ({nodes / max(elapsed, 1e-9):,.0f} nodes/s) {status}")
+    return expected is None or nodes == expected
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Count and time move generation to a fixed depth.")
+    parser.add_argument("--position", choices=sorted(POSITIONS), help="standard position to run (default: all)")
+    parser.add_argument("--fen", help="run a custom position instead")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--divide", action="store_true", help="print the count below each root move")
+    parser.add_argument("--workers", type=int, default=1, help="processes to split the root moves across")
+    parser.add_argument("--array", action="store_true", help="use the board array generator instead of bitboards")
+    args = parser.parse_args(argv)
+
+    if args.fen:
+        runs = [("fen", args.fen, None)]
+    else:
+        names = [args.position] if args.position else list(POSITIONS)
+        runs = []
+        for name in names:
+            fen, counts = POSITIONS[name]
+            runs.append((name, fen, counts[args.depth - 1] if args.depth <= len(counts) else None))
+    ok = True
+    for name, fen, expected in runs:
+        ok = run(name, fen, args.depth, expected, not args.array, args.workers, args.divide) and ok
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
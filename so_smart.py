@@ -1,4 +1,13 @@
+import json
+import os
+import queue
 import random
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from multiprocessing import shared_memory
+import bitboard
 import chess_engine
 
 
@@ -60,11 +69,432 @@ pawn_eval = [[0, 0, 0, 0, 0, 0, 0, 0],
 
 piece_evals = {"K": king_eval, "Q": queen_eval, "R": rook_eval, "B": bishop_eval, "N": knight_eval, "P": pawn_eval}
 
+# value of every piece on every square (positive for white, negative for black), for GameState.track_score
+square_scores = {"--": [0] * 64}
+for color, color_sign in (("w", 1), ("b", -1)):
+    for piece in piece_vals:
+        square_scores[color + piece] = [color_sign * (piece_vals[piece] + piece_evals[piece][sq // 8][sq % 8]) 
+                                        for sq in range(64)]
+
+# piece values used to order captures, the king being the least desirable attacker
+order_vals = {"K": 10, "Q": 9, "R": 5, "B": 3, "N": 3, "P": 1}
+
 CHECKMATE = 1_000_000
 STALEMATE = 0
 MAX_DEPTH = 4
+MAX_PLY = 64 # deepest ply killer moves are kept for
+DELTA_MARGIN = 2 # a capture in the quiescence search has to be able to raise the score by this much
+TT_SIZE_MB = 16 # memory budget of the transposition table
+PONDER_DEPTH = MAX_DEPTH + 2 # deepest a background search goes while the opponent thinks
+# selective search: both are turned off in a deterministic search, where they would make the 
+# score depend on the window it was searched with
+NULL_MOVE = True # try passing the turn first, if even that fails high the node is cut off
+NULL_MOVE_REDUCTION = 2 # extra plies the null move is searched shallower by
+NULL_MOVE_MIN_DEPTH = 3
+LATE_MOVE_REDUCTIONS = True # search quiet moves ordered late shallower, and again if they fail high
+LMR_FULL_MOVES = 3 # moves searched at full depth before reducing
+LMR_REDUCTION = 1
+LMR_MIN_DEPTH = 3
+ASPIRATION_WINDOW = 2 # the root is first searched this far either side of the last iteration's score
+ASPIRATION_MIN_DEPTH = 3
 # positive score means white is winning, negative score means black is winning
 
+# move ordering scores, searched from highest to lowest
+HASH_MOVE_SCORE = 10_000_000
+CAPTURE_SCORE = 1_000_000 # plus 10 * victim - attacker (MVV-LVA)
+PROMOTION_SCORE = 900_000
+KILLER_SCORES = (800_000, 700_000)
+HISTORY_MAX = 600_000 # history scores are kept below the killers
+
+# transposition table entry types
+EXACT = 1 # the stored score is the exact score of the position
+LOWER_BOUND = 2 # the search failed high, the score is at least the stored score
+UPPER_BOUND = 3 # the search failed low, the score is at most the stored score
+
+
+class TranspositionTable:
+    """
+    A fixed-size table of previously searched positions, keyed by the Zobrist key of the
+    GameState. Each bucket holds two entries: the first is only replaced by a search of equal
+    or greater depth, the second is always replaced. An entry is two 64-bit words, the packed
+    data and the key xor the data, so a torn or mismatched entry never validates.
+    """
+
+    ENTRY_WORDS = 2
+    BUCKET_WORDS = 4
+    SCORE_OFFSET = 1 << 31
+
+    def __init__(self, size_mb=TT_SIZE_MB, buffer=None):
+        """
+        __init__: a table of about size_mb megabytes. If a buffer of at least size_bytes(size_mb)
+        bytes is given, such as the buf of a multiprocessing SharedMemory, the table is kept in it
+        so that processes can share one table.
+        """
+        self.buckets = self.bucket_count(size_mb)
+        self.mask = self.buckets - 1
+        if buffer is None:
+            buffer = bytearray(self.size_bytes(size_mb))
+        self.table = memoryview(buffer).cast("B")[:self.size_bytes(size_mb)].cast("Q")
+
+
+    @classmethod
+    def bucket_count(cls, size_mb):
+        """
+        Gets the number of buckets in a table of about size_mb megabytes, a power of two.
+        """
+        buckets = max(1, (size_mb * 1024 * 1024) // (cls.BUCKET_WORDS * 8))
+        return 1 << (buckets.bit_length() - 1) # rounding down to a power of two
+
+
+    @classmethod
+    def size_bytes(cls, size_mb):
+        """
+        Gets the number of bytes a table of about size_mb megabytes takes up.
+        """
+        return cls.bucket_count(size_mb) * cls.BUCKET_WORDS * 8
+
+
+    def release(self):
+        """
+        Lets go of the buffer, which has to be done before a SharedMemory holding it is closed.
+        """
+        self.table.release()
+
+
+    def clear(self):
+        """
+        Empties the table.
+        """
+        self.table[:] = memoryview(bytes(len(self.table) * 8)).cast("Q")
+
+
+    def probe(self, key):
+        """
+        Looks up a position. Returns (depth, flag, score, move_code) or None if it is not stored.
+        """
+        i = (key & self.mask) * self.BUCKET_WORDS
+        table = self.table
+        for j in (i, i + self.ENTRY_WORDS):
+            data = table[j + 1]
+            if table[j] ^ data == key:
+                return ((data >> 32) & 0xFF, (data >> 40) & 0x3, (data & 0xFFFFFFFF) - self.SCORE_OFFSET, data >> 42)
+        return None
+
+
+    def store(self, key, depth, flag, score, move_code):
+        """
+        Stores a searched position. The depth-preferred entry is replaced when the new search is
+        at least as deep (or is the same position), otherwise the always-replace entry is used.
+        """
+        i = (key & self.mask) * self.BUCKET_WORDS
+        table = self.table
+        data = (score + self.SCORE_OFFSET) | depth << 32 | flag << 40 | move_code << 42
+        if depth >= (table[i + 1] >> 32) & 0xFF or table[i] ^ table[i + 1] == key:
+            table[i] = key ^ data
+            table[i + 1] = data
+        else:
+            table[i + 2] = key ^ data
+            table[i + 3] = data
+
+
+transposition_table = None # the table find_best_move uses when none is given, made on first use
+worker_table = None # the table of a root_split_search worker process
+root_pool = None # the root_split_search worker processes, kept with their tables between searches
+root_pool_size = None # and the (workers, table size) they were started with
+
+
+class SearchAborted(Exception):
+    """
+    Raised from inside the search when it runs out of time or nodes, or is told to stop.
+    """
+
+
+class Search:
+    """
+    The state shared by every node of one search: the transposition table, the time and node
+    budgets, an optional threading.Event that stops the search when set, and the results.
+    A deterministic search only takes cutoffs from table entries searched to exactly the same 
+    depth and breaks ties at the root by the lowest move code, so its result does not depend on 
+    what other searches put in the table or on the order the root moves are searched in.
+    """
+
+    CHECK_EVERY = 1024 # nodes between checks of the clock and the stop event
+
+    def __init__(self, tt=None, time_limit=None, max_nodes=None, stop_event=None, deterministic=False, stats=None,
+                 null_move=NULL_MOVE, late_move_reductions=LATE_MOVE_REDUCTIONS):
+        self.tt = tt
+        self.deterministic = deterministic
+        self.null_move = null_move and not deterministic
+        self.late_move_reductions = late_move_reductions and not deterministic
+        self.deadline = None if time_limit is None else time.perf_counter() + time_limit
+        self.max_nodes = max_nodes
+        self.stop_event = stop_event
+        self.nodes = 0
+        self.next_check = self.CHECK_EVERY
+        self.best_move = None # best move at the root of the current iteration
+        self.best_score = None # and its score, from the side to move's point of view
+        self.completed_depth = 0
+        self.principal_variation = [] # the best line of the deepest completed iteration
+        # the best line found below each ply, (move, reply, ...), built up as the search returns
+        self.pv_table = [()] * (MAX_PLY + 1)
+        self.stats = stats # a SearchStats when the search is instrumented
+        self.evaluate = score_pieces if stats is None else stats.evaluate # the leaf evaluation
+        # beta cutoffs, those caused by the first move searched, and cutoffs taken from the table
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+        self.tt_cutoffs = 0
+        # null moves that failed high, late moves searched shallower, and those searched again
+        self.null_cutoffs = 0
+        self.reductions = 0
+        self.re_searches = 0
+        self.aspiration_fails = 0 # root searches outside the aspiration window, searched again
+        self.draws = 0 # repeated and fifty-move positions, scored as draws without searching them
+        # move ordering: two quiet moves per ply that caused a cutoff, and cutoffs per piece and square
+        self.killers = [[None, None] for ply in range(MAX_PLY)]
+        self.history = {piece: [0] * 64 for piece in bitboard.PIECES}
+
+
+    def count_node(self):
+        """
+        Counts a searched node and raises SearchAborted if the search has to stop. The budgets
+        only apply once an iteration has completed, so a move is always found.
+        """
+        self.nodes += 1
+        if self.nodes < self.next_check:
+            return
+        self.next_check = self.nodes + self.CHECK_EVERY
+        if self.stop_event is not None and self.stop_event.is_set():
+            raise SearchAborted()
+        if self.completed_depth > 0:
+            if self.max_nodes is not None and self.nodes >= self.max_nodes:
+                raise SearchAborted()
+            if self.deadline is not None and time.perf_counter() >= self.deadline:
+                raise SearchAborted()
+        if self.max_nodes is not None:
+            self.next_check = min(self.next_check, self.max_nodes)
+
+
+    def update_cutoff(self, move, depth, ply):
+        """
+        Remembers a quiet move that caused a beta cutoff as a killer move for this ply and adds
+        to its history score, so it is tried earlier in sibling and later nodes.
+        """
+        if ply < MAX_PLY:
+            killers = self.killers[ply]
+            if killers[0] != move.code:
+                killers[1] = killers[0]
+                killers[0] = move.code
+        history = self.history[move.piece_moved]
+        end = move.end_row * 8 + move.end_col
+        history[end] += depth * depth
+        if history[end] > HISTORY_MAX: # keeping history below the killers by halving everything
+            for table in self.history.values():
+                for sq in range(64):
+                    table[sq] //= 2
+
+
+class SearchStats:
+    """
+    Counters and timers of one search, for sizing hardware and catching slowdowns. They are only 
+    collected when find_best_move is asked for them (or a SearchStats is given to Search): the 
+    search then calls the hooks below around move generation, make_move/undo_move, evaluation and 
+    table probes, and skips them otherwise. The timing adds its own overhead, which shows up in 
+    the phase times. After each completed iteration a record is added to iterations, and written 
+    as a line of JSON to log_path if given.
+    """
+
+    PHASES = ("movegen", "make_undo", "eval")
+
+    def __init__(self, log_path=None):
+        self.log_path = log_path
+        self.depth = 0 # deepest completed iteration
+        self.score = None
+        self.move = None # notation of the best move
+        self.pv = [] # and of the principal variation
+        self.nodes = 0
+        self.elapsed = 0.0
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+        self.tt_probes = 0
+        self.tt_hits = 0
+        self.tt_cutoffs = 0
+        self.null_cutoffs = 0
+        self.reductions = 0
+        self.re_searches = 0
+        self.aspiration_fails = 0
+        self.draws = 0
+        self.evals = 0
+        self.times = dict.fromkeys(self.PHASES, 0.0) # seconds spent in each phase
+        self.iterations = []
+        self.start_time = None
+
+
+    def start(self):
+        """
+        Starts the clock of the search.
+        """
+        self.start_time = time.perf_counter()
+
+
+    def timed(self, phase, function, *args):
+        """
+        Calls function with args, adding the time it takes to phase. Returns what the function 
+        returns.
+        """
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            self.times[phase] += time.perf_counter() - start
+
+
+    def evaluate(self, gs):
+        """
+        The leaf evaluation of an instrumented search: score_pieces, counted and timed. Returns the
+        score.
+        """
+        self.evals += 1
+        return self.timed("eval", score_pieces, gs)
+
+
+    def count_probe(self, entry):
+        """
+        Counts a transposition table probe, and a hit if an entry was found.
+        """
+        self.tt_probes += 1
+        if entry is not None:
+            self.tt_hits += 1
+
+
+    def update(self, search):
+        """
+        Copies the counters kept by the search itself.
+        """
+        self.elapsed = time.perf_counter() - self.start_time
+        self.nodes = search.nodes
+        self.cutoffs = search.cutoffs
+        self.first_move_cutoffs = search.first_move_cutoffs
+        self.tt_cutoffs = search.tt_cutoffs
+        self.null_cutoffs = search.null_cutoffs
+        self.reductions = search.reductions
+        self.re_searches = search.re_searches
+        self.aspiration_fails = search.aspiration_fails
+        self.draws = search.draws
+
+
+    def record(self, depth, score, move, search):
+        """
+        Records a completed iteration and writes it to the log.
+        """
+        self.update(search)
+        self.depth = depth
+        self.score = score
+        self.move = move.get_chess_notation()
+        self.pv = [played.get_chess_notation() for played in search.principal_variation]
+        record = self.as_dict()
+        self.iterations.append(record)
+        if self.log_path is not None:
+            with open(self.log_path, "a") as log:
+                log.write(json.dumps(record) + "\n")
+
+
+    def as_dict(self):
+        """
+        Gets the totals so far as a dictionary of plain values. Returns the dictionary.
+        """
+        elapsed = max(self.elapsed, 1e-9)
+        times = {phase: round(seconds, 6) for phase, seconds in self.times.items()}
+        times["other"] = round(max(0.0, self.elapsed - sum(self.times.values())), 6)
+        return {"depth": self.depth, "score": self.score, "move": self.move, "nodes": self.nodes, 
+                "time": round(self.elapsed, 6), "nps": round(self.nodes / elapsed), 
+                "cutoffs": self.cutoffs, "first_move_cutoff_rate": round(self.first_move_cutoffs / max(self.cutoffs, 1), 4), 
+                "tt_probes": self.tt_probes, "tt_hit_rate": round(self.tt_hits / max(self.tt_probes, 1), 4), 
+                "tt_cutoffs": self.tt_cutoffs, "null_cutoffs": self.null_cutoffs, "reductions": self.reductions, 
+                "re_searches": self.re_searches, "aspiration_fails": self.aspiration_fails, "draws": self.draws, 
+                "evals": self.evals, 
+                "pv": self.pv, "phase_times": times}
+
+
+def has_pieces(gs):
+    """
+    Checks if the side to move has a piece other than its king and pawns. Without one, passing
+    the turn is often better than any move (zugzwang), so a null move would say the position is
+    better than it is. Returns a boolean value.
+    """
+    for piece in gs.piece_squares["w" if gs.white_to_move else "b"].values():
+        if piece[1] not in "KP":
+            return True
+    return False
+
+
+def is_quiet(move):
+    """
+    Checks if a move is not a capture or a promotion. Returns a boolean value.
+    """
+    return move.piece_captured == "--" and not move.en_passant and not move.pawn_promotion
+
+
+def order_moves(moves, hash_code, ply, search):
+    """
+    Sorts a list of moves so the ones most likely to cause a cutoff are searched first: the 
+    hash move, then captures by MVV-LVA (most valuable victim, least valuable attacker), then 
+    promotions, then the killer moves of this ply, then quiet moves by their history score.
+    """
+    killers = search.killers[ply] if ply < MAX_PLY else (None, None)
+    history = search.history
+
+    def score(move):
+        if move.code == hash_code:
+            return HASH_MOVE_SCORE
+        if move.piece_captured != "--":
+            return CAPTURE_SCORE + 10 * order_vals[move.piece_captured[1]] - order_vals[move.piece_moved[1]]
+        if move.pawn_promotion:
+            return PROMOTION_SCORE
+        if move.code == killers[0]:
+            return KILLER_SCORES[0]
+        if move.code == killers[1]:
+            return KILLER_SCORES[1]
+        return history[move.piece_moved][move.end_row * 8 + move.end_col]
+
+    moves.sort(key=score, reverse=True)
+
+
+def staged_moves(gs, hash_code, ply, search):
+    """
+    Yields the valid moves in the same order as order_moves, but generates them stage by stage
+    so a cutoff early on saves generating the rest: the hash move, then captures and 
+    promotions, then the killer moves of this ply, then the quiet moves by history. The hash 
+    and killer moves come from other positions, so they are checked with gs.is_valid_move first.
+    """
+    stats = search.stats
+    stages = gs.get_move_stages()
+    searched = []
+    if hash_code is not None:
+        move = chess_engine.Move.from_code(hash_code)
+        valid = gs.is_valid_move(move) if stats is None else stats.timed("movegen", gs.is_valid_move, move)
+        if valid:
+            searched.append(move)
+            yield move
+    captures = next(stages) if stats is None else stats.timed("movegen", next, stages)
+    order_moves(captures, None, ply, search)
+    for move in captures:
+        if move not in searched:
+            yield move
+    if ply < MAX_PLY:
+        for code in search.killers[ply]:
+            if code is not None and code != hash_code:
+                move = chess_engine.Move.from_code(code)
+                valid = gs.is_valid_move(move) if stats is None else stats.timed("movegen", gs.is_valid_move, move)
+                if valid:
+                    searched.append(move)
+                    yield move
+    quiets = next(stages) if stats is None else stats.timed("movegen", next, stages)
+    order_moves(quiets, None, ply, search)
+    for move in quiets:
+        if move not in searched:
+            yield move
+
+
 def find_random_move(valid_moves):
     """
     Finds a random move for a given list or random moves
@@ -72,13 +502,361 @@ def find_random_move(valid_moves):
     return valid_moves[random.randint(0, len(valid_moves) - 1)]
 
 
-def find_best_move(gs, valid_moves):
-    global next_move
-    next_move = None
+def get_transposition_table():
+    """
+    Gets the table find_best_move uses when none is given. It is made on first use, so processes
+    that import the search but never run it, like most worker processes, do not pay for it.
+    """
+    global transposition_table
+    if transposition_table is None:
+        transposition_table = TranspositionTable()
+    return transposition_table
+
+
+def find_best_move(gs, valid_moves, tt=None, time_limit=None, max_nodes=None, stop_event=None, max_depth=MAX_DEPTH, 
+                   stats=False, stats_log=None):
+    """
+    Finds the best move with iterative deepening: searches to depth 1, 2, ... max_depth, each 
+    iteration starting from the best move of the last. The search stops early when time_limit 
+    (seconds) or max_nodes runs out, or when stop_event is set. Returns the best move of the 
+    deepest completed iteration (None if it was stopped before the first one completed). If stats 
+    is set or a stats_log file is given, the search's counters and timers are collected in a 
+    SearchStats (see there) and (best move, SearchStats) is returned instead.
+    """
+    search_stats = SearchStats(stats_log) if stats or stats_log is not None else None
+    search = Search(get_transposition_table() if tt is None else tt, time_limit, max_nodes, stop_event, stats=search_stats)
     random.shuffle(valid_moves)
-    #minimax(gs, valid_moves, MAX_DEPTH, True if gs.white_to_move else False)
-    negamax_alpha_beta(gs, valid_moves, MAX_DEPTH, -CHECKMATE, CHECKMATE, 1 if gs.white_to_move else -1)
-    return next_move
+    best = iterative_deepening(gs, valid_moves, search, max_depth)[0]
+    return best if search_stats is None else (best, search_stats)
+
+
+class StopFlag:
+    """
+    The stop_event of a search in a BackgroundSearch worker: set as soon as the caller wants a 
+    different task than the one being searched.
+    """
+
+    def __init__(self, wanted, task_id):
+        self.wanted = wanted
+        self.task_id = task_id
+
+
+    def is_set(self):
+        return self.wanted.value != self.task_id
+
+
+class BackgroundSearch:
+    """
+    Runs find_best_move in a worker process so the caller, such as the pygame loop, never waits
+    on it. search() starts a search and poll() gives the move once it is found, cancel() drops
+    whatever is running, and ponder() searches the position while the opponent thinks about it.
+    The worker keeps one transposition table, so pondering on the opponent's expected reply 
+    (the most searched line of the pondered position) fills the table for the next search.
+    """
+
+    def __init__(self, tt_size_mb=TT_SIZE_MB):
+        context = multiprocessing.get_context("spawn") # a forked pygame process is not safe to use
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        self.wanted = context.Value("q", 0) # the id of the task the caller wants, 0 for none
+        self.task_id = 0
+        self.thinking = False # a search (not a ponder) is running and has no move yet
+        self.process = context.Process(target=background_worker, args=(self.tasks, self.results, self.wanted, tt_size_mb), 
+                                       daemon=True)
+        self.process.start()
+
+
+    def search(self, gs, time_limit=None, max_depth=MAX_DEPTH):
+        """
+        Starts searching a copy of gs for its best move, stopping whatever was running.
+        """
+        self.start_task(gs, time_limit, max_depth)
+        self.thinking = True
+
+
+    def ponder(self, gs, max_depth=PONDER_DEPTH):
+        """
+        Starts searching a copy of gs, with the opponent to move, until the next search or cancel 
+        (or max_depth is done).
+        """
+        self.start_task(gs, None, max_depth)
+        self.thinking = False
+
+
+    def start_task(self, gs, time_limit, max_depth):
+        self.task_id += 1
+        self.wanted.value = self.task_id # stops the running task, if any
+        self.tasks.put((self.task_id, gs, time_limit, max_depth))
+
+
+    def poll(self):
+        """
+        Checks for the result of the running search without waiting. Returns the Move, or None 
+        if the search is still going (or nothing is being searched).
+        """
+        while self.thinking:
+            try:
+                task_id, move_code = self.results.get_nowait()
+            except queue.Empty:
+                return None
+            if task_id == self.task_id: # older results are from cancelled tasks and ponders
+                self.thinking = False
+                return chess_engine.Move.from_code(move_code)
+        return None
+
+
+    def cancel(self):
+        """
+        Stops the running search or ponder. Its result is never given by poll.
+        """
+        self.task_id += 1
+        self.wanted.value = self.task_id
+        self.thinking = False
+
+
+    def close(self):
+        """
+        Stops the worker process.
+        """
+        self.cancel()
+        self.tasks.put(None)
+        self.process.join(timeout=1)
+
+
+def background_worker(tasks, results, wanted, tt_size_mb):
+    """
+    The BackgroundSearch worker process: searches each task it is sent, unless it was cancelled 
+    before it started, and sends back (task id, move code). Runs until it is sent None.
+    """
+    tt = TranspositionTable(tt_size_mb)
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        task_id, gs, time_limit, max_depth = task
+        if wanted.value != task_id:
+            continue
+        valid_moves = gs.get_valid_moves()
+        if len(valid_moves) == 0:
+            continue
+        move = find_best_move(gs, valid_moves, tt, time_limit, stop_event=StopFlag(wanted, task_id), max_depth=max_depth)
+        if move is None: # stopped before the first iteration completed
+            move = find_random_move(valid_moves)
+        results.put((task_id, move.code))
+
+
+def iterative_deepening(gs, valid_moves, search, max_depth=MAX_DEPTH, report=None):
+    """
+    The iterative deepening loop of find_best_move, run with a given Search. From depth 
+    ASPIRATION_MIN_DEPTH on, the root is first searched with a window around the last 
+    iteration's score (an aspiration window), and again with that side of the window opened if 
+    the score falls outside it. The line expected from the best move is kept in 
+    search.principal_variation. If report is given, it is called with (depth, score, best move, 
+    search) after each completed iteration. Returns (best move, score) of the deepest completed 
+    iteration, the score being from the side to move's point of view ((None, None) if it was 
+    stopped before the first one completed, and None with the checkmate or stalemate score if 
+    there are no valid moves).
+    """
+    if len(valid_moves) == 0: # checkmate or stalemate, there is nothing to search
+        return None, -CHECKMATE if gs.is_in_check() else STALEMATE
+    if gs.square_scores is not square_scores:
+        gs.track_score(square_scores)
+    sign = 1 if gs.white_to_move else -1
+    start = len(gs.move_log)
+    best = None
+    best_score = None
+    stats = search.stats
+    if stats is not None:
+        stats.start()
+    try:
+        for depth in range(1, max_depth + 1):
+            alpha, beta = -CHECKMATE, CHECKMATE
+            if depth >= ASPIRATION_MIN_DEPTH and abs(best_score) < CHECKMATE:
+                alpha, beta = best_score - ASPIRATION_WINDOW, best_score + ASPIRATION_WINDOW
+            try:
+                while True:
+                    score = negamax_alpha_beta(gs, valid_moves, depth, alpha, beta, sign, search)
+                    if score <= alpha and alpha > -CHECKMATE:
+                        alpha = -CHECKMATE
+                    elif score >= beta and beta < CHECKMATE:
+                        beta = CHECKMATE
+                    else:
+                        break
+                    search.aspiration_fails += 1
+            except SearchAborted:
+                while len(gs.move_log) > start: # unwinding the moves of the unfinished iteration
+                    if gs.move_log[-1] is None:
+                        gs.undo_null_move()
+                    else:
+                        gs.undo_move()
+                break
+            best = search.best_move
+            best_score = score
+            search.completed_depth = depth
+            search.principal_variation = list(search.pv_table[0]) if search.pv_table[0][:1] == (best,) else [best]
+            if stats is not None:
+                stats.record(depth, score, best, search)
+            if report is not None:
+                report(depth, score, best, search)
+            if best is not None: # searching the best move first in the next iteration
+                valid_moves.remove(best)
+                valid_moves.insert(0, best)
+            if abs(score) >= CHECKMATE: # a forced mate was found, searching deeper will not change it
+                break
+    finally:
+        if stats is not None:
+            stats.update(search)
+    return best, best_score
+
+
+def find_best_move_parallel(gs, valid_moves, workers=None, mode="smp", max_depth=MAX_DEPTH, tt_size_mb=TT_SIZE_MB):
+    """
+    Finds the best move to max_depth on several cores. In "root" mode the root moves are split 
+    across a pool of processes, each searching its moves with its own table. 
+    In "smp" mode (Lazy SMP) this process and workers - 1 helper processes all search the whole 
+    tree, sharing one transposition table in shared memory, so the helpers fill the table with 
+    positions this process would otherwise search itself. Both searches are deterministic (see 
+    Search), so the result does not depend on the number of workers. Returns (best move, score), 
+    the score being from the side to move's point of view (None with the checkmate or stalemate 
+    score if there are no valid moves).
+    """
+    if len(valid_moves) == 0: # checkmate or stalemate, no processes are started
+        return None, -CHECKMATE if gs.is_in_check() else STALEMATE
+    workers = os.cpu_count() if workers is None else workers
+    valid_moves = sorted(valid_moves, key=lambda move: move.code)
+    if mode == "root":
+        return root_split_search(gs, valid_moves, workers, max_depth, tt_size_mb)
+    if mode == "smp":
+        return lazy_smp_search(gs, valid_moves, workers, max_depth, tt_size_mb)
+    raise ValueError(f"unknown parallel search mode {mode!r}")
+
+
+def root_split_search(gs, valid_moves, workers, max_depth, tt_size_mb):
+    """
+    Scores the root moves in a pool of worker processes without waiting on any one of them. A 
+    search two plies shallower (the same side to move at the leaves) gives the move scored 
+    first and a provisional score. The first move is scored exactly while the other moves are 
+    probed with a null window, to see if they score at least the provisional score. Once the 
+    first move's score is known, the probes that have not started yet are probed against that 
+    score instead, as are the moves whose first probe could not rule them out, and those that 
+    could beat or tie it are searched again for an exact score. Each round is submitted all at 
+    once. Returns (best move, score), ties going to the lowest move code.
+    """
+    first = valid_moves[0]
+    provisional = -CHECKMATE
+    if max_depth > 2:
+        first, provisional = iterative_deepening(gs, list(valid_moves), Search(TranspositionTable(1), deterministic=True), 
+                                                 max_depth - 2)
+    pool = get_root_pool(workers, tt_size_mb)
+    first_future = pool.submit(score_root_move, gs, first.code, max_depth, -CHECKMATE)
+    others = [move for move in valid_moves if move.code != first.code]
+    probes = [pool.submit(score_root_move, gs, move.code, max_depth, provisional - 1, provisional) for move in others]
+    best = first
+    best_score = first_future.result()
+    cancelled = [probe.cancel() for probe in probes]
+    checks = []
+    for move, probe, was_cancelled in zip(others, probes, cancelled):
+        if not was_cancelled:
+            score = probe.result()
+            if score < provisional <= best_score: # worse than the first move
+                continue
+            if score >= provisional > best_score: # better than the first move, its exact score is needed
+                checks.append((move, CHECKMATE, pool.submit(score_root_move, gs, move.code, max_depth, best_score - 1)))
+                continue
+        # a move above best_score - 1 beats or ties the first move
+        checks.append((move, best_score, pool.submit(score_root_move, gs, move.code, max_depth, best_score - 1, best_score)))
+    candidates = []
+    for move, beta, check in checks:
+        if check.result() > best_score - 1:
+            candidates.append((move, check if beta == CHECKMATE else 
+                               pool.submit(score_root_move, gs, move.code, max_depth, best_score - 1)))
+    for move, future in candidates: # every other move scores at most best_score - 1
+        score = future.result()
+        if score > best_score or (score == best_score and move.code < best.code):
+            best = move
+            best_score = score
+    return best, best_score
+
+
+def get_root_pool(workers, tt_size_mb):
+    """
+    Gets the pool of root_split_search worker processes, each with its own transposition table. 
+    It is started on first use and kept, tables and all, for the next searches with the same 
+    number of workers and table size. Returns the ProcessPoolExecutor.
+    """
+    global root_pool, root_pool_size
+    if root_pool is None or root_pool_size != (workers, tt_size_mb):
+        if root_pool is not None:
+            root_pool.shutdown()
+        root_pool = ProcessPoolExecutor(max_workers=workers, initializer=start_root_worker, initargs=(tt_size_mb,))
+        root_pool_size = (workers, tt_size_mb)
+    return root_pool
+
+
+def start_root_worker(tt_size_mb):
+    """
+    Gives a root_split_search worker process its own transposition table, kept for every root 
+    move it searches. Does not return anything.
+    """
+    global worker_table
+    worker_table = TranspositionTable(tt_size_mb)
+
+
+def score_root_move(gs, move_code, depth, alpha, beta=CHECKMATE):
+    """
+    Searches one root move to depth, in a worker process set up by start_root_worker. The 
+    GameState is a copy sent to the worker. Returns the score of the move from the root side's 
+    point of view, which is exact if it is between alpha and beta, otherwise at most alpha or at 
+    least beta.
+    """
+    if gs.square_scores is not square_scores: # the copy no longer tracks this module's table
+        gs.track_score(square_scores)
+    gs.make_move(chess_engine.Move.from_code(move_code))
+    search = Search(worker_table, deterministic=True)
+    sign = 1 if gs.white_to_move else -1
+    # searched straight to depth, deepening again for every root move costs more than the move 
+    # ordering it gives
+    return -negamax_alpha_beta(gs, None, depth - 1, -beta, -alpha, sign, search, ply=1)
+
+
+def lazy_smp_search(gs, valid_moves, workers, max_depth, tt_size_mb):
+    """
+    Searches the root in this process while workers - 1 helper processes search the same root 
+    in other move orders, all through one shared transposition table. Returns (best move, score).
+    """
+    shm = shared_memory.SharedMemory(create=True, size=TranspositionTable.size_bytes(tt_size_mb))
+    tt = TranspositionTable(tt_size_mb, shm.buf)
+    stop_event = multiprocessing.Event()
+    helpers = [multiprocessing.Process(target=lazy_smp_helper, daemon=True,
+                                       args=(gs, valid_moves, shm.name, tt_size_mb, max_depth, helper, stop_event))
+               for helper in range(1, workers)]
+    try:
+        for helper in helpers:
+            helper.start()
+        return iterative_deepening(gs, list(valid_moves), Search(tt, deterministic=True), max_depth)
+    finally:
+        stop_event.set()
+        for helper in helpers:
+            helper.join()
+        tt.release()
+        shm.close()
+        shm.unlink()
+
+
+def lazy_smp_helper(gs, valid_moves, shm_name, tt_size_mb, max_depth, helper, stop_event):
+    """
+    A Lazy SMP helper process: searches the root in its own order (the root moves rotated by
+    its helper number) until it is done or stop_event is set, storing what it finds in the
+    shared table. Does not return anything.
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    tt = TranspositionTable(tt_size_mb, shm.buf)
+    try:
+        shift = helper % len(valid_moves)
+        iterative_deepening(gs, valid_moves[shift:] + valid_moves[:shift], Search(tt, stop_event=stop_event, deterministic=True), max_depth)
+    finally:
+        tt.release()
+        shm.close()
 
 
 def best_move(gs, valid_moves):
@@ -108,7 +886,8 @@ def best_move(gs, valid_moves):
 
 def score_board(gs):
     """
-    A way to evaluate a certain position on a board.
+    A way to evaluate a certain position on a board. This is O(1) when the GameState tracks 
+    square_scores (find_best_move sets that up), otherwise every piece is looked at.
     """
     if gs.checkmate:
         if gs.white_to_move:
@@ -117,24 +896,90 @@ def score_board(gs):
             return CHECKMATE
     if gs.stalemate:
         return STALEMATE
+    return score_pieces(gs)
+
+
+def score_pieces(gs):
+    """
+    Evaluates the pieces on the board, without looking at checkmate or stalemate. This is O(1) 
+    when the GameState tracks square_scores, otherwise every piece is looked at.
+    """
+    if gs.square_scores is square_scores: # kept up to date by make_move / undo_move
+        return gs.board_score
     
     score = 0 
-    for row in range(len(gs.board)):
-        for col in range(len(gs.board[row])):
-            square = gs.board[row][col]
-            if square != "--":
-                pos_eval = piece_evals[square[1]]
-                piece_total = piece_vals[square[1]] + pos_eval[row][col]
-                if square[0] == "w":
-                    score += piece_total
-                elif square[0] == "b":
-                    score -= piece_total
+    for (row, col), square in gs.piece_squares["w"].items():
+        score += piece_vals[square[1]] + piece_evals[square[1]][row][col]
+    for (row, col), square in gs.piece_squares["b"].items():
+        score -= piece_vals[square[1]] + piece_evals[square[1]][row][col]
     return score
 
 
 
 
 
+@lru_cache(maxsize=None)
+def plane_tables():
+    """
+    Builds the piece names and the square_scores values as piece planes (one 8x8 plane per piece 
+    in bitboard.PIECES order) for batch scoring. numpy is only imported here, on the first batch 
+    call, so that importing the search does not pay for it. Returns (pieces, score planes).
+    """
+    import numpy as np
+    pieces = np.array(bitboard.PIECES)
+    scores = np.array([square_scores[piece] for piece in bitboard.PIECES], dtype=np.int64).reshape(12, 8, 8)
+    return pieces, scores
+
+
+def board_planes(boards):
+    """
+    Converts a board, or a stack of N boards, of piece strings (like GameState.board) into an
+    N x 12 x 8 x 8 boolean array with one plane per piece in bitboard.PIECES order. Returns the
+    array of planes.
+    """
+    import numpy as np
+    pieces = plane_tables()[0]
+    if len(boards) == 0: # an empty batch has no board shape to index
+        return np.zeros((0, len(pieces), 8, 8), dtype=bool)
+    boards = np.asarray(boards)
+    if boards.ndim == 2:
+        boards = boards[np.newaxis]
+    return boards[:, np.newaxis, :, :] == pieces[np.newaxis, :, np.newaxis, np.newaxis]
+
+
+def score_planes(planes):
+    """
+    Evaluates a stack of N x 12 x 8 x 8 piece planes in one call, with the same material and 
+    piece_evals values as score_board. Checkmate and stalemate are not detected here. Returns 
+    an array of N scores (positive means white is winning).
+    """
+    import numpy as np
+    return np.einsum("npij,pij->n", np.asarray(planes), plane_tables()[1])
+
+
+def score_boards(boards):
+    """
+    Evaluates a stack of N boards of piece strings in one call. Returns an array of N scores 
+    that agree with score_board for positions that are not checkmate or stalemate.
+    """
+    return score_planes(board_planes(boards))
+
+
+def score_game_states(game_states):
+    """
+    Evaluates a list of GameStates in one call, including the checkmate and stalemate scores 
+    that score_board gives. Returns an array of scores, in the same order.
+    """
+    import numpy as np
+    if len(game_states) == 0:
+        return np.zeros(0, dtype=np.int64)
+    scores = score_boards([gs.board for gs in game_states])
+    for i, gs in enumerate(game_states):
+        if gs.checkmate or gs.stalemate:
+            scores[i] = score_board(gs)
+    return scores
+
+
 def minimax(gs, valid_moves, depth, white_to_move):
     """
     A min max algorithm to find the best set of moves to play given a certain depth by 
@@ -192,29 +1037,189 @@ def negamax(gs, valid_moves, depth, sign):
         gs.undo_move()
     return max_score
 
-def negamax_alpha_beta(gs, valid_moves, depth, alpha, beta, sign):
+def negamax_alpha_beta(gs, valid_moves, depth, alpha, beta, sign, search, ply=0):
     """
     A negamax algorithm to find the best set of moves to play given a certain depth by 
     evaluating various positions and trying to get the largest. The deeper the depth, 
     the better the AI will be, and the longer it will take to move. The sign determines 
-    which value we will be adding to
+    which value we will be adding to. Positions already in the search's transposition table 
+    are not searched again if they were searched deep enough, and moves are searched in the 
+    order given by order_moves. valid_moves may be None, in which case they are only generated 
+    if the table cannot answer, and with bitboards only as far as staged_moves gets before a 
+    cutoff. Unless the search turns them off, a null move is tried before the moves (null-move 
+    pruning) and quiet moves ordered late are searched shallower first (late move reductions). 
+    Below the root, a position that has come up before in the game or the search, or that is 
+    drawn by the fifty-move rule, is scored as a draw without searching it. The best move at 
+    the root (ply 0) is stored in search.best_move.
     """
-    global next_move
-    if depth == 0: # base case
-        return score_board(gs) * sign
-    
+    search.count_node()
+    stats = search.stats
+    if ply <= MAX_PLY:
+        search.pv_table[ply] = ()
+    if ply > 0 and (gs.is_repetition() or gs.is_fifty_move_draw()):
+        # the first repetition is enough, a side that wants the draw can repeat it again
+        search.draws += 1
+        return STALEMATE
+    tt = search.tt
+    key = gs.zobrist_key
+    entry = None
+    if tt is not None and depth > 0:
+        entry = tt.probe(key)
+        if stats is not None:
+            stats.count_probe(entry)
+        if entry is not None:
+            entry_depth, flag, score, move_code = entry
+            # the root always searches to find a move
+            if ply > 0 and (entry_depth == depth or (entry_depth > depth and not search.deterministic)):
+                if flag == EXACT:
+                    search.tt_cutoffs += 1
+                    return score
+                elif flag == LOWER_BOUND:
+                    alpha = max(alpha, score)
+                elif flag == UPPER_BOUND:
+                    beta = min(beta, score)
+                if alpha >= beta:
+                    search.tt_cutoffs += 1
+                    return score
+    alpha_orig = alpha # after the table narrows the window, a fail low is an upper bound of the narrowed one
+    if depth == 0: # base case, searching the captures until the position is quiet
+        return quiescence(gs, alpha, beta, sign, search, ply)
+    in_check = None
+    if search.null_move and ply > 0 and depth >= NULL_MOVE_MIN_DEPTH and gs.move_log[-1] is not None \
+            and beta < CHECKMATE and search.evaluate(gs) * sign >= beta and has_pieces(gs):
+        in_check = gs.is_in_check()
+        if not in_check:
+            # if passing the turn still fails high, a real move almost surely would as well
+            gs.make_null_move()
+            score = -negamax_alpha_beta(gs, None, depth - 1 - NULL_MOVE_REDUCTION, -beta, -beta + 1, -sign, search, ply + 1)
+            gs.undo_null_move()
+            if score >= beta:
+                search.null_cutoffs += 1
+                return score if score < CHECKMATE else beta
+    late_moves = search.late_move_reductions and ply > 0 and depth >= LMR_MIN_DEPTH
+    if late_moves:
+        late_moves = not (gs.is_in_check() if in_check is None else in_check)
+    hash_code = None if entry is None else entry[3]
+    if valid_moves is None and gs.bitboards is not None:
+        moves = staged_moves(gs, hash_code, ply, search)
+    else:
+        if valid_moves is None:
+            valid_moves = gs.get_valid_moves() if stats is None else stats.timed("movegen", gs.get_valid_moves)
+        order_moves(valid_moves, hash_code, ply, search)
+        moves = valid_moves
+
     max_score = -CHECKMATE
-    for move in valid_moves:
-        gs.make_move(move)
-        new_valid_moves = gs.get_valid_moves()
-        score = -negamax_alpha_beta(gs, new_valid_moves, depth - 1, -beta, -alpha, -sign)
-        if score > max_score:
+    best = None
+    first = None
+    searched = 0
+    for move in moves:
+        if best is None:
+            best = first = move
+            if ply == 0:
+                search.best_move = move
+        if stats is None:
+            gs.make_move(move)
+        else:
+            stats.timed("make_undo", gs.make_move, move)
+        tie = False
+        if move is first:
+            score = -negamax_alpha_beta(gs, None, depth - 1, -beta, -alpha, -sign, search, ply + 1)
+        else:
+            # principal variation search: the first move is expected to be best, so the others are
+            # only checked to be no better with a null window, and searched in full if they are
+            low = alpha
+            if ply == 0 and search.deterministic and move.code < best.code:
+                low = alpha - 1 # widening the window by one to see a tie with the best move, ties go to the lower code
+            reduced = late_moves and searched >= LMR_FULL_MOVES and is_quiet(move) and not gs.is_in_check()
+            if reduced: # a quiet move ordered this late is checked with a shallower search as well
+                search.reductions += 1
+                score = -negamax_alpha_beta(gs, None, depth - 1 - LMR_REDUCTION, -(low + 1), -low, -sign, search, ply + 1)
+            else:
+                score = -negamax_alpha_beta(gs, None, depth - 1, -(low + 1), -low, -sign, search, ply + 1)
+            if score > low and (reduced or score < beta):
+                if reduced:
+                    search.re_searches += 1
+                score = -negamax_alpha_beta(gs, None, depth - 1, -beta, -low, -sign, search, ply + 1)
+            tie = low < alpha and score == max_score
+        searched += 1
+        if score > max_score or tie:
             max_score = score
-            if depth == MAX_DEPTH:
-                next_move = move
-        gs.undo_move()
+            best = move
+            if ply == 0:
+                search.best_move = move
+            if ply < MAX_PLY:
+                search.pv_table[ply] = (move,) + search.pv_table[ply + 1]
+        if stats is None:
+            gs.undo_move()
+        else:
+            stats.timed("make_undo", gs.undo_move)
         if max_score > alpha:
             alpha = max_score
         if alpha >= beta:
+            search.cutoffs += 1
+            if move is first:
+                search.first_move_cutoffs += 1
+            if is_quiet(move):
+                search.update_cutoff(move, depth, ply)
             break
-    return max_score
\ No newline at end of file
+    if best is None: # no valid moves, checkmate or stalemate
+        return -CHECKMATE if gs.in_check else STALEMATE
+    if tt is not None:
+        if max_score <= alpha_orig:
+            flag = UPPER_BOUND
+        elif max_score >= beta:
+            flag = LOWER_BOUND
+        else:
+            flag = EXACT
+        tt.store(key, depth, flag, max_score, best.code)
+    return max_score
+
+
+def quiescence(gs, alpha, beta, sign, search, ply):
+    """
+    Searches only captures and promotions from a leaf of negamax_alpha_beta, so a position is 
+    never scored in the middle of an exchange. The side to move can "stand pat" on the score of
+    the position instead of capturing, and captures that could not raise the score to alpha even 
+    when winning the piece for free (delta pruning) are skipped, except in a deterministic search
+    where the margin could make the score depend on the window. In check every move is searched.
+    Returns the score from the side to move's point of view.
+    """
+    search.count_node()
+    stats = search.stats
+    stages = gs.get_move_stages()
+    moves = next(stages) if stats is None else stats.timed("movegen", next, stages)
+    if gs.in_check: # there is no standing pat in check, every evasion is searched
+        moves += next(stages) if stats is None else stats.timed("movegen", next, stages)
+        if len(moves) == 0:
+            return -CHECKMATE
+        stand_pat = max_score = -CHECKMATE
+    else:
+        stand_pat = max_score = search.evaluate(gs) * sign
+        if stand_pat >= beta:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+    order_moves(moves, None, ply, search)
+    delta_pruning = stand_pat > -CHECKMATE and not search.deterministic
+    for move in moves:
+        if delta_pruning and not move.pawn_promotion:
+            optimistic = stand_pat + piece_vals[move.piece_captured[1]] + DELTA_MARGIN
+            if optimistic <= alpha:
+                max_score = max(max_score, optimistic) # the skipped capture scores at most this
+                continue
+        if stats is None:
+            gs.make_move(move)
+        else:
+            stats.timed("make_undo", gs.make_move, move)
+        score = -quiescence(gs, -beta, -alpha, -sign, search, ply + 1)
+        if stats is None:
+            gs.undo_move()
+        else:
+            stats.timed("make_undo", gs.undo_move)
+        if score > max_score:
+            max_score = score
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
+                    break
+    return max_score
@@ -0,0 +1,42 @@
+"""
+Checks of so_smart that the engine's own scripts (perft.py, headless.py) do not cover. Run with
+'python -m pytest'.
+"""
+import os
+import time
+import pytest
+import chess_engine
+import so_smart
+
+KIWIPETE = "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1"
+
+
+def test_empty_batch():
+    """
+    The batch evaluators accept an empty batch and give back no scores.
+    """
+    assert so_smart.board_planes([]).shape == (0, 12, 8, 8)
+    for scores in (so_smart.score_boards([]), so_smart.score_game_states([])):
+        assert scores.shape == (0,) and scores.dtype.kind == "i"
+
+
+def timed_root_search(workers, depth):
+    gs = chess_engine.GameState(use_bitboards=True, fen=KIWIPETE)
+    so_smart.find_best_move_parallel(gs, gs.get_valid_moves(), workers, "root", 1) # starting the pool first
+    start = time.perf_counter()
+    move, score = so_smart.find_best_move_parallel(gs, gs.get_valid_moves(), workers, "root", depth)
+    return move.code, score, time.perf_counter() - start
+
+
+@pytest.mark.skipif((os.cpu_count() or 1) < 2, reason="needs at least two cores")
+def test_root_split_speedup():
+    """
+    Splitting the root moves across every core finds the same move as one worker, faster.
+    """
+    workers = min(os.cpu_count(), 8)
+    one_code, one_score, one_time = timed_root_search(1, 4)
+    many_code, many_score, many_time = timed_root_search(workers, 4)
+    print(f"root split depth 4: 1 worker {one_time:.2f}s, {workers} workers {many_time:.2f}s "
+          f"({one_time / many_time:.1f}x)")
+    assert (many_code, many_score) == (one_code, one_score)
+    assert many_time < one_time * 0.8
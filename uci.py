@@ -0,0 +1,237 @@
+"""
+A UCI (Universal Chess Interface) front end, so the engine can be run by chess GUIs, tournament
+managers and analysis tools, or pooled behind a dispatcher. Commands are read from stdin and
+answers written to stdout. The search runs in its own thread, so "stop" and "isready" are
+answered while it is thinking.
+
+    python uci.py
+
+Supported: uci, isready, setoption (Hash, NullMove, LateMoveReductions), ucinewgame,
+position startpos/fen ... moves ..., go depth/movetime/wtime/btime/winc/binc/movestogo/infinite, stop, quit.
+Promotions are always to a queen in this engine.
+"""
+import sys
+import threading
+import time
+import chess_engine
+import so_smart
+
+ENGINE_NAME = "so_smart"
+ENGINE_AUTHOR = "benpipkorn"
+INFINITE_DEPTH = so_smart.MAX_PLY # the deepest iteration of "go infinite"
+MOVES_TO_GO = 30 # moves the remaining clock time is shared between when "movestogo" is not given
+MOVE_OVERHEAD = 0.05 # seconds kept back from each move for the GUI and the pipe
+
+
+def find_move(gs, notation):
+    """
+    Finds the valid move written in UCI notation (like e2e4 or e7e8q). Returns the Move, or None
+    if it is not a valid move in the position.
+    """
+    for move in gs.get_valid_moves():
+        if move.get_uci_notation()[:4] == notation[:4]:
+            return move
+    return None
+
+
+def think_time(clock, increment, moves_to_go):
+    """
+    Works out how long to search for from the time left on the clock and the increment, all in
+    milliseconds. Returns the time in seconds.
+    """
+    share = clock / max(moves_to_go, 1) + increment / 2
+    return max(0.01, min(share, clock / 2) / 1000 - MOVE_OVERHEAD)
+
+
+class UciEngine:
+    """
+    The state of one UCI session: the current position, the transposition table kept between
+    moves, and the search thread with the event that stops it.
+    """
+
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self.output_lock = threading.Lock() # both threads write to the output
+        self.hash_mb = so_smart.TT_SIZE_MB
+        self.null_move = so_smart.NULL_MOVE
+        self.late_move_reductions = so_smart.LATE_MOVE_REDUCTIONS
+        self.tt = so_smart.TranspositionTable(self.hash_mb)
+        self.gs = chess_engine.GameState(use_bitboards=True)
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.start_time = 0
+
+
+    def send(self, line):
+        """
+        Writes one line to the GUI.
+        """
+        with self.output_lock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+
+    def handle(self, line):
+        """
+        Carries out one command. Returns False once the session should end.
+        """
+        words = line.split()
+        if not words:
+            return True
+        command = words[0]
+        if command == "uci":
+            self.send("id name " + ENGINE_NAME)
+            self.send("id author " + ENGINE_AUTHOR)
+            self.send(f"option name Hash type spin default {so_smart.TT_SIZE_MB} min 1 max 4096")
+            self.send(f"option name NullMove type check default {str(so_smart.NULL_MOVE).lower()}")
+            self.send(f"option name LateMoveReductions type check default {str(so_smart.LATE_MOVE_REDUCTIONS).lower()}")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "setoption":
+            self.stop()
+            self.set_option(words[1:])
+        elif command == "ucinewgame":
+            self.stop()
+            self.tt.clear()
+            self.gs = chess_engine.GameState(use_bitboards=True)
+        elif command == "position":
+            self.stop()
+            self.set_position(words[1:])
+        elif command == "go":
+            self.stop()
+            self.go(words[1:])
+        elif command == "stop":
+            self.stop()
+        elif command == "quit":
+            self.stop()
+            return False
+        else:
+            self.send("info string unknown command " + command)
+        return True
+
+
+    def set_option(self, words):
+        """
+        Handles "setoption name <name> value <value>" for Hash (table size in MB), NullMove and 
+        LateMoveReductions (true or false).
+        """
+        if "value" not in words:
+            return
+        name = " ".join(words[1:words.index("value")]).lower()
+        value = " ".join(words[words.index("value") + 1:])
+        if name == "hash" and value.isdigit():
+            self.hash_mb = max(1, int(value))
+            self.tt = so_smart.TranspositionTable(self.hash_mb)
+        elif name == "nullmove":
+            self.null_move = value.lower() == "true"
+        elif name == "latemovereductions":
+            self.late_move_reductions = value.lower() == "true"
+
+
+    def set_position(self, words):
+        """
+        Handles "position startpos|fen <fen> [moves <move> ...]".
+        """
+        moves = []
+        if "moves" in words:
+            moves = words[words.index("moves") + 1:]
+            words = words[:words.index("moves")]
+        if words and words[0] == "fen":
+            self.gs = chess_engine.GameState(use_bitboards=True, fen=" ".join(words[1:]))
+        else:
+            self.gs = chess_engine.GameState(use_bitboards=True)
+        for notation in moves:
+            move = find_move(self.gs, notation)
+            if move is None:
+                self.send("info string illegal move " + notation)
+                return
+            if move.pawn_promotion and notation[4:] not in ("", "q"):
+                self.send("info string only promotions to a queen are supported, " + notation + " promotes to a queen")
+            self.gs.make_move(move)
+
+
+    def go(self, words):
+        """
+        Handles "go" by starting the search thread with the limits given.
+        """
+        limits = {}
+        for i, word in enumerate(words[:-1]):
+            if words[i + 1].lstrip("-").isdigit():
+                limits[word] = int(words[i + 1])
+        infinite = "infinite" in words
+        time_limit = None
+        if "movetime" in limits:
+            time_limit = max(0.01, limits["movetime"] / 1000 - MOVE_OVERHEAD)
+        elif not infinite:
+            clock, increment = ("wtime", "winc") if self.gs.white_to_move else ("btime", "binc")
+            if clock in limits:
+                time_limit = think_time(limits[clock], limits.get(increment, 0), limits.get("movestogo", MOVES_TO_GO))
+        if "depth" in limits:
+            max_depth = max(1, limits["depth"])
+        elif infinite or time_limit is not None: # deepening until the time runs out or it is stopped
+            max_depth = INFINITE_DEPTH
+        else:
+            max_depth = so_smart.MAX_DEPTH
+        self.stop_event.clear()
+        self.start_time = time.perf_counter()
+        self.thread = threading.Thread(target=self.think, args=(self.gs, max_depth, time_limit, infinite), daemon=True)
+        self.thread.start()
+
+
+    def stop(self):
+        """
+        Stops the search, if one is running, and waits for it to send its best move.
+        """
+        if self.thread is not None:
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+
+
+    def think(self, gs, max_depth, time_limit, infinite):
+        """
+        The search thread: searches until a limit is reached or it is stopped, then sends the best
+        move. "go infinite" only sends it once it is stopped, as the protocol asks.
+        """
+        valid_moves = gs.get_valid_moves()
+        if len(valid_moves) == 0:
+            if infinite:
+                self.stop_event.wait()
+            self.send("bestmove 0000")
+            return
+        search = so_smart.Search(self.tt, time_limit, stop_event=self.stop_event, null_move=self.null_move, 
+                                 late_move_reductions=self.late_move_reductions)
+        best = so_smart.iterative_deepening(gs, valid_moves, search, max_depth, self.report)[0]
+        if best is None: # stopped before the first iteration completed
+            best = valid_moves[0]
+        if infinite:
+            self.stop_event.wait()
+        self.send("bestmove " + best.get_uci_notation())
+
+
+    def report(self, depth, score, best, search):
+        """
+        Sends an info line after each completed iteration.
+        """
+        elapsed = time.perf_counter() - self.start_time
+        if abs(score) >= so_smart.CHECKMATE: # the first iteration to see the mate is its distance in plies
+            score_text = "mate " + str((depth + 1) // 2 if score > 0 else -(depth // 2))
+        else:
+            score_text = "cp " + str(score * 100) # a pawn is worth 1
+        pv = search.principal_variation
+        self.send(f"info depth {depth} score {score_text} nodes {search.nodes} nps {int(search.nodes / max(elapsed, 1e-6))} "
+                  f"time {int(elapsed * 1000)} pv " + " ".join(move.get_uci_notation() for move in pv))
+
+
+def main():
+    engine = UciEngine()
+    for line in sys.stdin:
+        if not engine.handle(line):
+            break
+    engine.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())